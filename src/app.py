@@ -5,89 +5,239 @@ from datetime import datetime, timedelta
 import sys
 import atexit
 import signal
-import time
 import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import http_status as status
 from sbsys_operations import SBSYSOperations
 from openid_integration import AuthorizationHelper
-from database import DatabaseClient, Base, SignaturFileupload  # , FileObject
-from config import DEBUG, KEYCLOAK_URL, KEYCLOAK_REALM, KEYCLOAK_AUDIENCE, DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER, SD_URL, SD_USERNAME, SD_PASSWORD, SD_PERSONALESAG_ROBOT_USERNAME
+from database import DatabaseClient, SignaturFileupload, SIGNATUR_FILEUPLOAD_CHANNEL  # , FileObject
+from migrations import run_migrations
+from config import DEBUG, KEYCLOAK_URL, KEYCLOAK_REALM, KEYCLOAK_AUDIENCE, DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER, DB_MIGRATION_MODE, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_PRE_PING, DB_POOL_RECYCLE, DB_STATEMENT_TIMEOUT_MS, DB_APPLICATION_NAME, SD_URL, SD_USERNAME, SD_PASSWORD, SD_PERSONALESAG_ROBOT_USERNAME, WORKER_COUNT, WORKER_BATCH_SIZE, LOOKUP_THREADS, LOOKUP_TIMEOUT_SECONDS, WORKER_ERROR_SLEEP_SECONDS, WORKER_IDLE_MIN_SECONDS, WORKER_IDLE_MAX_SECONDS, DEPARTMENT_INDEX_REFRESH_SECONDS, DEPARTMENT_INDEX_CHECK_SECONDS, SD_DEPARTMENT_CACHE_TTL_SECONDS, SBSYS_PERSONALESAG_CACHE_TTL_SECONDS, PERSONALESAG_MAPPING_CACHE_SIZE, RETENTION_DAYS, RETENTION_BATCH_SIZE, RETENTION_CHECK_SECONDS, RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS, RETRY_CHECK_SECONDS
 from request_validation import is_cpr, is_employment, is_institution, is_pdf  # , is_timestamp
 from utils import set_logging_configuration, generate_response, STATUS_CODE  # , SignaturFileupload
 from sd.sd_client import SDClient
-from browserless import browserless_sd_personalesag_files, browserless_sd_personalesag_exist
+from browserless import browserless_sd_personalesag_files, browserless_sd_personalesag_exist, browserless_metrics
+from http_session import pool_metrics
+from personalesag_mapping import PersonalesagMappingCache
+from lookups import run_lookups
+from department_index import DepartmentIndexCache, Level3DepartmentLookup, DepartmentNameIndex, get_department_name_index
 
 set_logging_configuration()
 
 
 # ## Worker start ## #
-def worker_job():
-    logger = logging.getLogger('worker_thread')
+def worker_job(worker_name):
+    logger = logging.getLogger(worker_name)
     logger.info("Worker started")
 
-    departments_by_level_3 = None
-    departments_by_level_3_updated = datetime.now()
+    worker_health = worker_status[worker_name]
+    idle_sleep = WORKER_IDLE_MIN_SECONDS
 
     while not worker_stop_event.is_set():
-        # Fetch the departments by level 3 every 12 hours
-        if not departments_by_level_3 or (datetime.now() - departments_by_level_3_updated).seconds > 43200:
-            departments_by_level_3 = group_by_level_3('9R')
-            departments_by_level_3_updated = datetime.now()
-        with db_client.get_session() as sess:
-            # Clean up database
-            old_files = db_client.get_stuck_signatur_file_uploads(sess)
-            if old_files:
-                logger.info(f"Cleaning up {len(old_files)} old files - setting status to failed")
-                for f in old_files:
-                    f.set_status(STATUS_CODE.FAILED, "File was not processed in time")
-
-            # Fetch the next file to process
-            upload_file = db_client.get_next_signatur_file_upload(sess)
-            if upload_file:
-
-                if not departments_by_level_3:
-                    logger.error("No departments found")
-                    upload_file.set_status(STATUS_CODE.FAILED, "No departments found")
-                    sess.commit()
-                else:
-                    logger.info(f"Processing file with id: {upload_file.id}")
-                    # times_to_try = 3
-                    # time_to_sleep = 5
-                    # i = 0
-
-                    # while i < times_to_try:
-                    sag = fetch_personalesag(upload_file.cpr, upload_file.employment, upload_file.institutionIdentifier, departments_by_level_3)
-                    if sag:
-                        logger.info(f"Found sag: {sag.get('Id', None)} - uploading file")
-                        if journalise_document(sag, upload_file):
-                            logger.info(f"File {upload_file.file_name} was uploaded successfully")
-                            upload_file.set_status(STATUS_CODE.SUCCESS, "File was uploaded successfully")
-                            # break
-                        else:
-                            logger.error(f"Failed to upload file {upload_file.file_name}")
-                            upload_file.set_status(STATUS_CODE.FAILED_TRY_AGAIN, "Failed to upload file, try again")
-                    else:
-                        logger.error(f"No sag found for cpr: {upload_file.cpr} and employment: {upload_file.employment}")
-                        # if i < times_to_try - 1:
-                            # logger.info(f"Failed to find sag, try: {i+1}, will try again in {time_to_sleep} seconds")
-                        # else:
-                            # logger.info(f"Failed to find sag, try: {i+1}, will not try again")
-                        upload_file.set_status(STATUS_CODE.FAILED_TRY_AGAIN, "No case found in SBSYS")
-                        # i += 1
-                        # time.sleep(time_to_sleep)
-            sess.commit()
+        worker_health['heartbeat'] = datetime.now()
+        upload_files = None
+        level_3_departments = department_index.get()
+        if not level_3_departments:
+            # Don't claim uploads before the department index is available
+            department_index.ready.wait(WORKER_IDLE_MIN_SECONDS)
+            continue
+
+        try:
+            # Clear before looking for work, so an upload signalled while we query is not missed
+            upload_event.clear()
+            with db_client.get_session() as sess:
+                # Clean up database
+                stuck_count = db_client.fail_stuck_signatur_file_uploads(sess, "File was not processed in time")
+                if stuck_count:
+                    logger.info(f"Cleaned up {stuck_count} old files - status set to failed")
+
+                # Claim the next upload and the uploads queued for the same employment - rows locked by other workers are skipped
+                upload_files = db_client.claim_signatur_file_upload_group(sess, WORKER_BATCH_SIZE)
+                if upload_files:
+                    worker_health['current'] = ', '.join(str(upload.id) for upload in upload_files)
+                    try:
+                        process_upload_group(logger, sess, upload_files, level_3_departments)
+                    except Exception as e:
+                        logger.error(f"Worker error while processing files for employment {upload_files[0].employment}: {e}")
+                        worker_health['errors'] += 1
+                        # Files already handled were committed with their status and retry - only the files left in PROCESSING are reset
+                        sess.rollback()
+                        for upload in upload_files:
+                            if upload.status == STATUS_CODE.PROCESSING:
+                                upload.set_status(STATUS_CODE.FAILED_TRY_AGAIN, "An unexpected error occurred, try again")
+                                schedule_upload_retry(logger, upload)
+                        sess.commit()
+                    worker_health['processed'] += len(upload_files)
+                    worker_health['current'] = None
+        except Exception as e:
+            logger.error(f"Worker error: {e}")
+            worker_health['errors'] += 1
+            worker_health['current'] = None
+            worker_stop_event.wait(WORKER_ERROR_SLEEP_SECONDS)
+            continue
+
+        if upload_files:
+            idle_sleep = WORKER_IDLE_MIN_SECONDS
+        else:
+            # Queue is empty - block until an upload is signalled, backing off while it stays empty
+            upload_event.wait(idle_sleep)
+            idle_sleep = min(idle_sleep * 2, WORKER_IDLE_MAX_SECONDS)
     logger.info("Worker stopped")
 
 
-worker = threading.Thread(target=worker_job)
+def process_upload_group(logger, sess, uploads, level_3_departments):
+    # The sag and delforloeb are resolved once and all files of the group are journalised to it.
+    # The status of each file is committed as soon as it is journalised.
+    first = uploads[0]
+    logger.info(f"Processing {len(uploads)} files with ids: {', '.join(str(upload.id) for upload in uploads)}")
+    sag, delforloeb_id = resolve_sag_and_delforloeb(logger, first.cpr, first.employment, first.institutionIdentifier, level_3_departments)
+    if not sag:
+        logger.error(f"No sag found for cpr: {first.cpr} and employment: {first.employment}")
+        for upload in uploads:
+            upload.set_status(STATUS_CODE.FAILED_TRY_AGAIN, "No case found in SBSYS")
+            schedule_upload_retry(logger, upload)
+        sess.commit()
+    else:
+        logger.info(f"Found sag: {sag.get('Id', None)} - uploading {len(uploads)} files")
+        failed = delforloeb_id is None
+        for upload in uploads:
+            if delforloeb_id is not None and upload_document(sag, delforloeb_id, upload):
+                logger.info(f"File {upload.file_name} was uploaded successfully")
+                upload.set_status(STATUS_CODE.SUCCESS, "File was uploaded successfully")
+            else:
+                logger.error(f"Failed to upload file {upload.file_name}")
+                upload.set_status(STATUS_CODE.FAILED_TRY_AGAIN, "Failed to upload file, try again")
+                schedule_upload_retry(logger, upload)
+                failed = True
+            sess.commit()
+        if failed:
+            # The mapping may be stale - the retry matches SD and SBSYS again
+            personalesag_mappings.invalidate(first.cpr, first.employment, first.institutionIdentifier)
+        elif sag.get('Id', None) is not None:
+            personalesag_mappings.save(first.cpr, first.employment, first.institutionIdentifier, sag['Id'], delforloeb_id)
+
+
+def resolve_sag_and_delforloeb(logger, cpr, employment, institution_identifier, level_3_departments):
+    # Uses the sag and delforloeb the employment was last journalised to, as long as the sag is still an active personalesag
+    mapping = personalesag_mappings.get(cpr, employment, institution_identifier)
+    if mapping:
+        sag_id, delforloeb_id = mapping
+        sag = next((sag for sag in sbsys.fetch_active_personalesager(cpr) or [] if sag.get('Id', None) == sag_id), None)
+        if sag:
+            logger.info(f"Using sag {sag_id} and delforloeb {delforloeb_id} journalised to before for employment {employment}")
+            return sag, delforloeb_id
+        personalesag_mappings.invalidate(cpr, employment, institution_identifier)
+
+    sag = fetch_personalesag(cpr, employment, institution_identifier, level_3_departments)
+    if not sag:
+        return None, None
+    return sag, find_delforloeb_id(sag)
+
+
+def schedule_upload_retry(logger, upload):
+    if upload.status != STATUS_CODE.FAILED_TRY_AGAIN:
+        return
+    next_attempt_at = upload.schedule_retry(RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS, RETRY_MAX_ATTEMPTS)
+    if next_attempt_at:
+        logger.info(f"Retrying file {upload.id} at {next_attempt_at} - attempt {upload.attempt_count + 1}")
+    else:
+        logger.error(f"Giving up on file {upload.id} after {upload.attempt_count} attempts")
+
+
+def listener_job():
+    logger = logging.getLogger('listener_thread')
+    logger.info("Listener started")
+    db_client.listen(SIGNATUR_FILEUPLOAD_CHANNEL, lambda payload: upload_event.set(), worker_stop_event)
+    logger.info("Listener stopped")
+
+
+def notify_upload_received(upload):
+    # Wake workers in this process right away, and workers in other processes through Postgres NOTIFY
+    upload_event.set()
+    db_client.notify(SIGNATUR_FILEUPLOAD_CHANNEL, str(upload.get_id()))
+
+
+def department_index_job():
+    logger = logging.getLogger('department_index_thread')
+    logger.info("Department index refresh started")
+    department_index.refresh_job(worker_stop_event)
+    logger.info("Department index refresh stopped")
+
+
+def retry_job():
+    logger = logging.getLogger('retry_thread')
+    logger.info("Retry scheduler started")
+    while not worker_stop_event.is_set():
+        try:
+            with db_client.get_session() as session:
+                count = db_client.requeue_due_signatur_file_uploads(session)
+            if count:
+                logger.info(f"Requeued {count} files for another attempt")
+                upload_event.set()
+        except Exception as e:
+            logger.error(f"Retry scheduler error: {e}")
+        worker_stop_event.wait(RETRY_CHECK_SECONDS)
+    logger.info("Retry scheduler stopped")
+
+
+def retention_job():
+    logger = logging.getLogger('retention_thread')
+    logger.info("Retention started")
+    while not worker_stop_event.is_set():
+        try:
+            older_than = datetime.now() - timedelta(days=RETENTION_DAYS)
+            uploads, bytes_reclaimed = 0, 0
+            # Small batches keep each transaction and its row locks short
+            while not worker_stop_event.is_set():
+                with db_client.get_session() as session:
+                    count, size = db_client.purge_signatur_file_upload_files(session, older_than, RETENTION_BATCH_SIZE)
+                uploads += count
+                bytes_reclaimed += size
+                if count < RETENTION_BATCH_SIZE:
+                    break
+            retention_status['uploads'] += uploads
+            retention_status['bytes_reclaimed'] += bytes_reclaimed
+            retention_status['last_run'] = datetime.now()
+            if uploads:
+                logger.info(f"Removed the files of {uploads} uploads older than {RETENTION_DAYS} days - {bytes_reclaimed} bytes reclaimed")
+        except Exception as e:
+            logger.error(f"Retention error: {e}")
+        worker_stop_event.wait(RETENTION_CHECK_SECONDS)
+    logger.info("Retention stopped")
+
+
 worker_stop_event = threading.Event()
+upload_event = threading.Event()
+listener = threading.Thread(target=listener_job, name='listener_thread')
+department_index_thread = threading.Thread(target=department_index_job, name='department_index_thread')
+retention_thread = threading.Thread(target=retention_job, name='retention_thread')
+retry_thread = threading.Thread(target=retry_job, name='retry_thread')
+lookup_executor = ThreadPoolExecutor(max_workers=LOOKUP_THREADS, thread_name_prefix='lookup_thread')
+retention_status = {'uploads': 0, 'bytes_reclaimed': 0, 'last_run': None}
+workers = [threading.Thread(target=worker_job, args=(f'worker_thread_{i}',), name=f'worker_thread_{i}') for i in range(WORKER_COUNT)]
+worker_status = {w.name: {'processed': 0, 'errors': 0, 'current': None, 'heartbeat': None} for w in workers}
+
+
+def start_workers():
+    department_index_thread.start()
+    listener.start()
+    retry_thread.start()
+    if RETENTION_DAYS > 0:
+        retention_thread.start()
+    for w in workers:
+        w.start()
 
 
 def stop_worker():
-    global worker, worker_stop_event
+    global workers, worker_stop_event
     worker_stop_event.set()
-    worker.join()
+    upload_event.set()
+    # Workers finish their current group first - it may still submit lookups
+    for w in workers + [listener, department_index_thread, retention_thread, retry_thread]:
+        if w.is_alive():
+            w.join()
+    lookup_executor.shutdown(wait=False, cancel_futures=True)
 
 
 def shutdown_server(sig, frame):
@@ -96,22 +246,66 @@ def shutdown_server(sig, frame):
 
 
 def is_worker_running():
-    global worker
-    return worker.is_alive(), 'worker is running' if worker.is_alive() else 'worker is not running'
+    global workers
+    running = [w for w in workers if w.is_alive()]
+    all_running = len(running) == len(workers)
+    return all_running, f'{len(running)} of {len(workers)} workers are running'
+
+
+def worker_pool_status():
+    global workers
+    output = {}
+    for w in workers:
+        worker_health = worker_status[w.name]
+        output[w.name] = {
+            'alive': w.is_alive(),
+            'processed': worker_health['processed'],
+            'errors': worker_health['errors'],
+            'current': worker_health['current'],
+            'heartbeat': worker_health['heartbeat'].isoformat() if worker_health['heartbeat'] else None
+        }
+    return all(w.is_alive() for w in workers), output
+
+
+def department_index_status():
+    # Reported without failing /healthz - a missing index is a readiness concern, not a reason to restart the container
+    return True, department_index.status()
+
+
+def is_department_index_ready():
+    department_index_status = department_index.status()
+    return department_index_status['ready'], department_index_status
 
 # ## Worker end ## #
 
 
-health = HealthCheck(checkers=[is_worker_running])
+health = HealthCheck(checkers=[is_worker_running, worker_pool_status, department_index_status])
+readiness = HealthCheck(checkers=[is_department_index_ready])
 ah = AuthorizationHelper(KEYCLOAK_URL, KEYCLOAK_REALM, KEYCLOAK_AUDIENCE)
-sbsys = SBSYSOperations()
-sd_client = SDClient(username=SD_USERNAME, password=SD_PASSWORD, url=SD_URL)
-db_client = DatabaseClient('postgresql', DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+sbsys = SBSYSOperations(personalesager_cache_ttl=SBSYS_PERSONALESAG_CACHE_TTL_SECONDS)
+sd_client = SDClient(username=SD_USERNAME, password=SD_PASSWORD, url=SD_URL, cache_ttl=SD_DEPARTMENT_CACHE_TTL_SECONDS)
+db_client = DatabaseClient('postgresql', DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                           pool_timeout=DB_POOL_TIMEOUT, pool_pre_ping=DB_POOL_PRE_PING, pool_recycle=DB_POOL_RECYCLE,
+                           statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS, application_name=DB_APPLICATION_NAME)
+personalesag_mappings = PersonalesagMappingCache(db_client, PERSONALESAG_MAPPING_CACHE_SIZE)
+department_index = DepartmentIndexCache(db_client, '9R', lambda region_identifier: group_by_level_3(region_identifier), DEPARTMENT_INDEX_REFRESH_SECONDS, DEPARTMENT_INDEX_CHECK_SECONDS)
 logger = logging.getLogger(__name__)
 
 
-# Set up the database
-Base.metadata.create_all(db_client.get_engine())
+# Set up the database - see migrations.py
+run_migrations(db_client, DB_MIGRATION_MODE)
+
+
+def collect_metrics():
+    return {
+        'sd_departments_cache': sd_client.cache_stats(),
+        'sbsys_personalesager_cache': sbsys.cache_stats(),
+        'personalesag_mappings': personalesag_mappings.stats(),
+        'http_pools': pool_metrics(),
+        'db_pool': db_client.pool_metrics(),
+        'browserless': browserless_metrics(),
+        'retention': {**retention_status, 'last_run': retention_status['last_run'].isoformat() if retention_status['last_run'] else None}
+    }
 
 
 def create_app():
@@ -120,6 +314,8 @@ def create_app():
 
     app = Flask(__name__)
     app.add_url_rule("/healthz", "healthcheck", view_func=lambda: health.run())
+    app.add_url_rule("/readyz", "readiness", view_func=lambda: readiness.run())
+    app.add_url_rule("/metrics", "metrics", view_func=collect_metrics)
     return app
 
 
@@ -157,8 +353,12 @@ def sbsys_journaliser_ansattelse_fil():
                         return generate_response("File is being processed", status.HTTP_400_BAD_REQUEST, received_id=id)
 
                     if not any([cpr, employment, institutionIdentifier, file]) and upload:
+                        if not upload.has_file():
+                            return generate_response("The file has been removed, upload it again", status.HTTP_400_BAD_REQUEST, received_id=id)
+                        upload.reset_attempts()
                         upload.set_status(STATUS_CODE.RECEIVED, "File upload updated")
                         session.commit()
+                        notify_upload_received(upload)
                         return generate_response('', status.HTTP_200_OK, upload)
                     elif not all([cpr, employment, institutionIdentifier, file]) and upload:
                         return generate_response("Missing form-data parameter, must contain cpr, institution, employment and file", http_code=status.HTTP_400_BAD_REQUEST, received_id=id)
@@ -177,11 +377,15 @@ def sbsys_journaliser_ansattelse_fil():
                 
                 if upload:
                     upload.update_values(file=file, institutionIdentifier=institutionIdentifier, employment=employment, cpr=cpr)
+                    upload.store_file(session, file)
                     session.commit()
+                    notify_upload_received(upload)
                     return generate_response('', status.HTTP_200_OK, upload)
                 else:
                     upload = SignaturFileupload(file=file, institutionIdentifier=institutionIdentifier, employment=employment, cpr=cpr)
+                    upload.store_file(session, file)
                     if db_client.add_object(session, upload):
+                        notify_upload_received(upload)
                         return generate_response('', status.HTTP_201_CREATED, upload)
                     else:
                         raise Exception("Unexpected error occurred")
@@ -198,7 +402,7 @@ def sbsys_journaliser_ansattelse_fil_status():
         id = request.args.get('id', None)
         if id:
             with db_client.get_session() as session:
-                upload = db_client.get_signatur_file_upload(session, id)
+                upload = db_client.get_signatur_file_upload_status(session, id)
                 # upload = signatur_fileuploads.get(id)
                 if upload:
                     # TODO: Fix message
@@ -271,9 +475,15 @@ def fetch_personalesag(cpr, employment_identifier, institution_identifier, level
     )
 
 
-def find_personalesag_by_sd_employment(cpr: str, employment_identifier: str, inst_code: str, level_3_departments: dict):
-    # Fetch SD employment
-    employment = sd_client.GetEmployment20111201(cpr=cpr, employment_identifier=employment_identifier, inst_code=inst_code)
+def find_personalesag_by_sd_employment(cpr: str, employment_identifier: str, inst_code: str, level_3_departments: Level3DepartmentLookup):
+    # Fetch SD employment, SD departments and the person's active personalesager at the same time
+    results = run_lookups(lookup_executor, {
+        'employment': lambda: sd_client.GetEmployment20111201(cpr=cpr, employment_identifier=employment_identifier, inst_code=inst_code),
+        'departments': lambda: sd_client.fetch_departments(inst_identifier=inst_code),
+        'sager': lambda: sbsys.fetch_active_personalesager(cpr)
+    }, required=['employment', 'departments'], timeout=LOOKUP_TIMEOUT_SECONDS)
+
+    employment = results.get('employment')
     if not employment:
         logger.warning(f"No employment found with cpr: {cpr}, employment_identifier: {employment_identifier}, and inst_code: {inst_code}")
         return None
@@ -283,22 +493,28 @@ def find_personalesag_by_sd_employment(cpr: str, employment_identifier: str, ins
         logger.warning(f"No department identifier found with cpr: {cpr}, employment_identifier: {employment_identifier}, and inst_code: {inst_code}")
         return None
 
-    institutions_and_departments = sd_client.fetch_departments(inst_identifier=inst_code)
+    institutions_and_departments = results.get('departments')
 
     if not institutions_and_departments:
         logger.warning("No institutions_and_departments were found on region code 9R")
         return None
 
-    # Fetch the person active personalesager
-    sager = sbsys.fetch_active_personalesager(cpr)
+    department_name_index = get_department_name_index(inst_code, institutions_and_departments)
+
+    # The person active personalesager - a failed lookup is retried later, it must not lead to creating a personalesag
+    if 'sager' not in results:
+        logger.error(f"Unable to look up sager for cpr: {cpr} - trying again later")
+        return None
+    sager = results['sager']
 
     input_string = f'{cpr.replace("-", "")} {employment_identifier}'
 
     if not sager:
         logger.info(f"No sag found with cpr: {cpr} - trying to force create personalesag")
         res_dict = check_sd_has_personalesag(input_string)
-        if res_dict.get('success', None):
+        if res_dict and res_dict.get('success', None):
             logger.info(f"Personalesag was created for cpr: {cpr} - trying to fetch sager again")
+            sbsys.invalidate_active_personalesager(cpr)
             sager = sbsys.fetch_active_personalesager(cpr)
 
     if not sager:
@@ -309,20 +525,21 @@ def find_personalesag_by_sd_employment(cpr: str, employment_identifier: str, ins
 
     # Go through sager and compare ansaettelsessted from sag to DepartmentCode from SD employment
     for sag in sager:
-        matched_sag = compare_sag_ansaettelssted(sag, employment, institutions_and_departments)
+        matched_sag = compare_sag_ansaettelssted(sag, employment, department_name_index)
         if matched_sag:
             logger.info(f"Match found between employment_identifier, and sag_id: {employment_identifier}, {matched_sag.get('Id', None)}")
             return matched_sag
 
     # No matched sag - trying to create personalesag
     res_dict = check_sd_has_personalesag(input_string)
-    if res_dict.get('success', None):
+    if res_dict and res_dict.get('success', None):
         logger.info(f"Personalesag was created for cpr: {cpr} - trying to fetch sager again")
+        sbsys.invalidate_active_personalesager(cpr)
         sager = sbsys.fetch_active_personalesager(cpr)
 
     # Go through sager and compare ansaettelsessted from sag to DepartmentCode from SD employment
     for sag in sager:
-        matched_sag = compare_sag_ansaettelssted(sag, employment, institutions_and_departments)
+        matched_sag = compare_sag_ansaettelssted(sag, employment, department_name_index)
         if matched_sag:
             logger.info(f"Match found between employment_identifier, and sag_id: {employment_identifier}, {matched_sag.get('Id', None)}")
             return matched_sag
@@ -338,7 +555,7 @@ def find_personalesag_by_sd_employment(cpr: str, employment_identifier: str, ins
     return None
 
 
-def compare_sag_ansaettelssted(sag: dict, employment, institutions_and_departments):
+def compare_sag_ansaettelssted(sag: dict, employment, department_name_index: DepartmentNameIndex):
     sag_id = sag.get('Id', None)
 
     if not sag_id:
@@ -350,7 +567,7 @@ def compare_sag_ansaettelssted(sag: dict, employment, institutions_and_departmen
         logger.error(f"sag_employment_location is None - No Ansaettelsessted found on sag id: {sag_id}")
         return None
 
-    department_codes = find_department_codes(institutions_and_departments, sag_employment_location)
+    department_codes = find_department_codes(department_name_index, sag_employment_location)
     if not department_codes:
         logger.error(f"department_codes is None - sag with id: {sag_id} {sag_employment_location} does not correspond with any SD departments")
         return None
@@ -426,63 +643,14 @@ def compare_sag_and_results(sd_result: dict, sag: dict):
     return sag if all_match else None
 
 
-def find_department_codes(inst_list: list, sag_employment_location: str):
-    def recursive_search(department):
-        if isinstance(department, list):
-            codes = []
-            for dept in department:
-                result = recursive_search(dept)
-                if result:
-                    codes.extend(result['DepartmentCodes'])
-            return {
-                'DepartmentCodeName': sag_employment_location,
-                'DepartmentCodes': list(set(codes))  # Ensure unique codes
-            } if codes else None
-        elif isinstance(department, dict):
-            codes = []
-            department_name = department.get('DepartmentName', '')
-            # Ensure department_name is a string and not None
-            if isinstance(department_name, str):
-                # Check for partial match with full string
-                if sag_employment_location in department_name:
-                    codes.append(department.get('DepartmentIdentifier'))
-                # Check if DepartmentCodeName is exactly 30 characters
-                if len(department_name) == 30 and sag_employment_location.startswith(department_name):
-                    codes.append(department.get('DepartmentIdentifier'))
-            # Recursively search within nested departments
-            if 'Department' in department and department['Department'] is not None:
-                result = recursive_search(department['Department'])
-                if result:
-                    codes.extend(result['DepartmentCodes'])
-            return {
-                'DepartmentCodeName': sag_employment_location,
-                'DepartmentCodes': list(set(codes))  # Ensure unique codes
-            } if codes else None
-        return None
-
-    all_codes = []
-    for institution in inst_list:
-        result = recursive_search(institution.get('Department', {}))
-        if result:
-            all_codes.append(result)
-
-    # Combine results for the same department name
-    combined_results = {}
-    for item in all_codes:
-        if item['DepartmentCodeName'] in combined_results:
-            combined_results[item['DepartmentCodeName']]['DepartmentCodes'].extend(item['DepartmentCodes'])
-            combined_results[item['DepartmentCodeName']]['DepartmentCodes'] = list(
-                set(combined_results[item['DepartmentCodeName']]['DepartmentCodes']))
-        else:
-            combined_results[item['DepartmentCodeName']] = item
-
-    # Convert combined results to a list
-    result_list = list(combined_results.values())
-
-    # Return a single object if there is exactly one match, otherwise return the list
-    if len(result_list) == 1:
-        return result_list[0]
-    return result_list
+def find_department_codes(department_name_index: DepartmentNameIndex, sag_employment_location: str):
+    codes = department_name_index.find(sag_employment_location)
+    if not codes:
+        return []
+    return {
+        'DepartmentCodeName': sag_employment_location,
+        'DepartmentCodes': list(codes)
+    }
 
 
 def filter_employment_by_department(employment_list, department_code_list, sag_id, department_name):
@@ -501,34 +669,30 @@ def filter_employment_by_department(employment_list, department_code_list, sag_i
 
 def fetch_sd_employment_files(input_strings: list):
     try:
-        # Make the request and get the response
-        response = browserless_sd_personalesag_files(input_strings)
-
-        # Check if the response status code is 200
-        if response.status_code == 200:
-            # Return the content if the status is 200
-            return response.json()  # Assuming the content is JSON
-        else:
-            # Handle the error case (you can raise an exception or return an error message)
-            raise Exception(f"Request failed with status code: {response.status_code}")
+        # Make the request and get the response data - None if the request failed
+        return browserless_sd_personalesag_files(input_strings)
     except Exception as e:
         logger.error(f"fetch_sd_employment_files error: {e}")
         return None
 
 
 def check_sd_has_personalesag(input_string: str):
-    try:
-        # Make the request and get the response
-        response = browserless_sd_personalesag_exist(input_string)
+    results = check_sd_has_personalesag_batch([input_string])
+    if not results:
+        return None
+    return results.get(input_string, None)
 
-        # Check if the response status code is 200
-        if response.status_code == 200:
-            # Return the content if the status is 200
-            return response.json()  # Assuming the content is JSON
-        else:
-            logger.error(f"Request failed with status code: {response.status_code} and message: {response.content}")
+
+def check_sd_has_personalesag_batch(input_strings: list):
+    # Returns a dict of input string -> {"inputString", "success", "msg"}, all checked in one browserless run
+    try:
+        # Make the request and get the response data - None if the request failed
+        data = browserless_sd_personalesag_exist(input_strings)
+        if not data:
+            return None
+        return {result['inputString']: result for result in data.get('results', [])}
     except Exception as e:
-        logger.error(f"fetch_sd_employment_files error: {e}")
+        logger.error(f"check_sd_has_personalesag_batch error: {e}")
         return None
 
 
@@ -536,20 +700,29 @@ class JournalisationError(Exception):
     pass
 
 
-def journalise_document(sag: object, upload):
+def find_delforloeb_id(sag: object):
     try:
         # For a given sag, save the array of delforloeb
         delforloeb_array = sbsys.find_personalesag_delforloeb(sag)
-        if len(delforloeb_array) < 1:
+        if not delforloeb_array:
             logger.error("No delforloeb found for case")
-            upload.set_status(STATUS_CODE.FAILED, "No delforloeb found for case")
             return None
 
         delforloeb_object_from_index = delforloeb_array[0]  # Select the first delforloeb object
-        delforloeb_id = delforloeb_object_from_index["ID"]  # Save the unique ID of the delforloeb object
+        return delforloeb_object_from_index["ID"]  # Save the unique ID of the delforloeb object
+    except Exception as e:
+        logger.error(f"find_delforloeb_id error: {e}")
+        return None
 
-        # Journalise file
-        response = sbsys.journalise_file(sag, upload.file, delforloeb_id, upload.id)
+
+def upload_document(sag: object, delforloeb_id, upload):
+    try:
+        # Journalise file - the file is streamed from the database while it is sent
+        file = upload.file
+        try:
+            response = sbsys.journalise_file(sag, file, delforloeb_id, upload.id)
+        finally:
+            file.stream.close()
 
         logger.info(f"Journalise response: {response}")
 
@@ -559,7 +732,7 @@ def journalise_document(sag: object, upload):
 
         return response
     except Exception as e:
-        logger.error(f"journalise_document error: {e}")
+        logger.error(f"upload_document error: {e}")
         upload.set_status(STATUS_CODE.FAILED, "An unexpected error occurred")
 
 
@@ -711,18 +884,19 @@ def group_by_level_3(region_identifier):
         logger.error("Unable to fetch institutions flattened")
         return None
     
-    all_departments = []
+    # Department code -> name, the first department found with a code wins
+    department_names = {}
     for institution in institutions_flattened:
         if isinstance(institution.get("Department", None), list):
             for department in institution.get("Department", None):
-                all_departments.append({'code': department.get("DepartmentIdentifier", None), 'name': department.get("DepartmentName", None)})
+                department_names.setdefault(department.get("DepartmentIdentifier", None), department.get("DepartmentName", None))
         else:
             logger.error(f'SD level 3 - Institution with id: {institution.get("InstitutionIdentifier", None)} - Department value is not a list')
 
     for key, value in departments_by_level_3.items():
         names = []
         for code in value.get('codes'):
-            department_name = next((item['name'] for item in all_departments if item["code"] == code), None)
+            department_name = department_names.get(code, None)
             if department_name:
                 names.append(department_name)
             else:
@@ -733,17 +907,16 @@ def group_by_level_3(region_identifier):
     return departments_by_level_3
 
 
-def compare_sd_and_sbsys_employment_place_by_level_3(sag, employment, level_3_departments):
-    for key in level_3_departments:
-        if (sag.get('Ansaettelsessted', None).get('Navn', None) in level_3_departments[key].get('names', []) and
-                employment.get('EmploymentDepartment', {}).get('DepartmentIdentifier') in level_3_departments[key].get('codes', [])):
-            return sag
+def compare_sd_and_sbsys_employment_place_by_level_3(sag, employment, level_3_departments: Level3DepartmentLookup):
+    if level_3_departments.match(sag.get('Ansaettelsessted', None).get('Navn', None),
+                                 employment.get('EmploymentDepartment', {}).get('DepartmentIdentifier')):
+        return sag
 
 # LEVEL 3 stuff END
 
 
 if __name__ == "__main__":
-    worker.start()
+    start_workers()
     atexit.register(stop_worker)
     signal.signal(signal.SIGINT, shutdown_server)
     app.run(debug=DEBUG, host='0.0.0.0', port=8080)
@@ -0,0 +1,61 @@
+import json
+import logging
+import httpx
+from abc import ABC, abstractmethod
+from config import HTTP_POOL_MAXSIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+def create_async_client(pool_maxsize=HTTP_POOL_MAXSIZE, connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT):
+    # httpx client with a keep-alive connection pool and the same default timeouts as http_session.create_session
+    return httpx.AsyncClient(limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize),
+                             timeout=httpx.Timeout(read_timeout, connect=connect_timeout))
+
+
+# Abstract async api client class - same methods as BaseAPIClient, awaited
+class AsyncBaseAPIClient(ABC):
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.client = create_async_client()
+
+    @abstractmethod
+    def get_headers(self):
+        pass
+
+    async def _make_request(self, method, path, **kwargs):
+        headers = self.get_headers()
+        if path.startswith("http://") or path.startswith("https://"):
+            url = path
+        else:
+            url = f"{self.base_url.rstrip('/')}/{path.lstrip('/')}"
+        response = None
+        try:
+            response = await self.client.request(method, url, headers=headers, **kwargs)
+            response.raise_for_status()
+            try:
+                return response.json()
+            except json.JSONDecodeError:
+                if not response.content:
+                    return 'success'
+                return response
+        except httpx.HTTPError as e:
+            logger.error(e)
+            if response is not None and response.content:
+                logger.error(response.content)
+            return None
+
+    async def get(self, path, **kwargs):
+        return await self._make_request('GET', path, **kwargs)
+
+    async def post(self, path, data=None, json=None, **kwargs):
+        return await self._make_request('POST', path, data=data, json=json, **kwargs)
+
+    async def put(self, path, data=None, json=None, **kwargs):
+        return await self._make_request('PUT', path, data=data, json=json, **kwargs)
+
+    async def delete(self, path, **kwargs):
+        return await self._make_request('DELETE', path, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,117 @@
+import asyncio
+import httpx
+import logging
+
+from config import SBSYS_URL
+from async_api_client import create_async_client
+from utils import MultipartStream
+
+logger = logging.getLogger(__name__)
+
+
+async def iterate_body(body):
+    # Reads the multipart body in a thread, as reading the file may block on the database
+    body.rewind()
+    chunk = await asyncio.to_thread(body.read, body.chunk_size)
+    while chunk:
+        yield chunk
+        chunk = await asyncio.to_thread(body.read, body.chunk_size)
+
+
+# Async counterpart of utils.APIClient.
+# Tokens are rarely requested and refreshed in the background, so it uses the blocking TokenManager of the sync client.
+class AsyncAPIClient:
+    def __init__(self, sbsys_url, token_manager):
+        self.sbsys_url = sbsys_url
+        self.client = create_async_client()
+        self.token_manager = token_manager
+
+    async def get_access_token(self):
+        if self.token_manager.is_valid():
+            return self.token_manager.get_access_token()
+        return await asyncio.to_thread(self.token_manager.get_access_token)
+
+    async def _make_request(self, method, path, retry_unauthorized=True, content_type="application/json", body=None, **kwargs):
+        token = await self.get_access_token()
+        url = f"{self.sbsys_url}/{path}"
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": content_type
+        }
+
+        if body is not None:
+            # Streamed with a known length, so SBSYS gets a Content-Length instead of a chunked body
+            headers["Content-Length"] = str(len(body))
+            kwargs['content'] = iterate_body(body)
+
+        try:
+            response = await self.client.request(method, url, headers=headers, **kwargs)
+            if response.status_code == 401 and retry_unauthorized:
+                # The token was revoked or expired early - get a new one and try once more
+                self.token_manager.invalidate()
+                kwargs.pop('content', None)
+                return await self._make_request(method, path, retry_unauthorized=False, content_type=content_type, body=body, **kwargs)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            logging.error(e)
+            return None
+
+    async def get(self, path):
+        return await self._make_request('GET', path)
+
+    async def post_upload(self, path, data=None, files=None):
+        body = MultipartStream(data or {}, files or {})
+        return await self._make_request('POST', path, content_type=body.content_type, body=body)
+
+    async def post(self, path, data=None):
+        return await self._make_request('POST', path, json=data)
+
+    async def put(self, path, data=None):
+        return await self._make_request('PUT', path, json=data)
+
+    async def delete(self, path):
+        return await self._make_request('DELETE', path)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# Async counterpart of utils.SBSYSClient with the same method surface - token_manager is the one of the sync client,
+# e.g. SBSYSClient().api_client.token_manager, so both share one SBSIP token
+class AsyncSBSYSClient:
+    def __init__(self, token_manager):
+        self.api_client = AsyncAPIClient(SBSYS_URL, token_manager)
+
+    # søg efter sager
+    async def search_cases(self, body):
+        path = "api/sag/search"
+        return await self.api_client.post(path, data=body)
+
+    async def get_sag_delforloeb(self, sag):
+        path = "api/sag/" + str(sag["Id"]) + "/delforloeb"
+        return await self.api_client.get(path)
+
+    async def get_request(self, path):
+        return await self.api_client.get(path)
+
+    async def post_request(self, path, data=None):
+        return await self.api_client.post(path, data)
+
+    async def put_request(self, path, data=None):
+        return await self.api_client.put(path, data)
+
+    async def delete_request(self, path):
+        return await self.api_client.delete(path)
+
+    # journaliser fil
+    async def journalise_file_personalesag(self, data, files, delforloeb_id):
+        path = "api/dokument/journaliser/" + str(delforloeb_id)
+        return await self.api_client.post_upload(path, data=data, files=files)
+
+    async def fetch_documents(self, sag_id):
+        path = f"api/sag/{sag_id}/dokumenter"
+        return await self.api_client.get(path=path)
+
+    async def aclose(self):
+        await self.api_client.aclose()
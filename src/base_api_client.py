@@ -2,14 +2,16 @@ import json
 import logging
 from abc import ABC, abstractmethod
 import requests
+from http_session import create_session
 
 logger = logging.getLogger(__name__)
 
 
 # Abstract base api client class
 class BaseAPIClient(ABC):
-    def __init__(self, base_url):
+    def __init__(self, base_url, session_name='api'):
         self.base_url = base_url
+        self.session = create_session(session_name)
 
     @abstractmethod
     def get_headers(self):
@@ -21,6 +23,7 @@ class BaseAPIClient(ABC):
             url = path
         else:
             url = f"{self.base_url.rstrip('/')}/{path.lstrip('/')}"
+        response = None
         try:
             response = method(url, headers=headers, **kwargs)
             response.raise_for_status()
@@ -32,21 +35,21 @@ class BaseAPIClient(ABC):
                 return response
         except requests.exceptions.RequestException as e:
             logger.error(e)
-            if response.content:
+            if response is not None and response.content:
                 logger.error(response.content)
             return None
 
     def get(self, path, **kwargs):
-        return self._make_request(requests.get, path, **kwargs)
+        return self._make_request(self.session.get, path, **kwargs)
 
     def post(self, path, data=None, json=None, **kwargs):
-        return self._make_request(requests.post, path, data=data, json=json, **kwargs)
+        return self._make_request(self.session.post, path, data=data, json=json, **kwargs)
 
     def post_upload(self, path, data=None, files=None):
-        return self._make_request(requests.post, path, data=data, files=files)
+        return self._make_request(self.session.post, path, data=data, files=files)
 
     def put(self, path, data=None, json=None, **kwargs):
-        return self._make_request(requests.put, path, data=data, json=json, **kwargs)
+        return self._make_request(self.session.put, path, data=data, json=json, **kwargs)
 
     def delete(self, path, **kwargs):
-        return self._make_request(requests.delete, path, **kwargs)
+        return self._make_request(self.session.delete, path, **kwargs)
@@ -1,385 +1,120 @@
+import os
+import re
 import logging
-import requests
+import threading
 from requests.auth import HTTPBasicAuth
 from config import BROWSERLESS_CLIENT_ID, BROWSERLESS_CLIENT_SECRET, SD_PERSONALESAG_ROBOT_USERNAME, \
-    SD_PERSONALESAG_ROBOT_PASSWORD, BROWSERLESS_URL
+    SD_PERSONALESAG_ROBOT_PASSWORD, BROWSERLESS_URL, BROWSERLESS_READ_TIMEOUT, BROWSERLESS_SELECTOR_TIMEOUT_MS, \
+    BROWSERLESS_NAVIGATION_TIMEOUT_MS, BROWSERLESS_PROBE_TIMEOUT_MS, BROWSERLESS_NETWORK_IDLE_MS, BROWSERLESS_MAX_CONCURRENCY, BROWSERLESS_QUEUE_TIMEOUT
+from http_session import create_session
+from limiter import PriorityLimiter
 
 
 logger = logging.getLogger(__name__)
 
+# A browserless function run logs into SD and can take minutes
+session = create_session('browserless', read_timeout=BROWSERLESS_READ_TIMEOUT)
 
-def browserless_sd_personalesag_files(input_strings):
-    # Input strings should be a list of strings with cpr and employmentidentifier e.g. ['0102039999 01010']
-    # url = "https://browserless.prototypes.randers.dk/function"
-    url = BROWSERLESS_URL + "/function"
-    headers = {
-        "Content-Type": "application/javascript",
-    }
-    data = """
-   module.exports = async ({ page }) => {
-
-    // Array of input strings
-  const inputStrings = """ + f"{input_strings}" + """
-
-
- const processRows = async () =>
-    {
-        await page.waitForTimeout(3000); // Adjust the timeout as necessary
-        // Wait for the table wrapper to ensure the table is visible
-        await page.waitForSelector('#psagform\\\\:sk\\\\:j_idt107\\\\:0\\\\:j_idt124\\\\:0\\\\:table1\\\\:table1_data', { timeout: 3000 });
-
-        // Extract text from each row
-        const rows = await page.evaluate(() => {
-            // Get all rows in the table body
-            const rows = document.querySelectorAll('#psagform\\\\:sk\\\\:j_idt107\\\\:0\\\\:j_idt124\\\\:0\\\\:table1\\\\:table1_data tr');
-            let rowData = [];
-
-            // Iterate through each row
-            rows.forEach(row => {
-                // Extract text from each cell
-                const cells = row.querySelectorAll('td[role="gridcell"]');
-                if (cells.length > 0) {
-                    // Extract 'Navn' and 'Arkivdato' based on their column positions
-                    const navn = cells[3] ? cells[3].innerText.trim() : '';  // Column for 'Navn'
-                    const arkivdato = cells[8] ? cells[8].innerText.trim() : '';  // Column for 'Arkivdato'
-
-                    // Add row data
-                    rowData.push({ navn, arkivdato });
-                }
-            });
-            console.log("rowData: " + rowData)
-            return rowData;
-        });
-        return rows;
-    }
+# Each run holds a browser on the Browserless server, so only a few run at a time.
+# Lower priority values are let through first when runs are queued.
+limiter = PriorityLimiter(BROWSERLESS_MAX_CONCURRENCY, BROWSERLESS_QUEUE_TIMEOUT)
+PRIORITY_EXIST = 0
+PRIORITY_FILES = 10
 
 
-
-  // Function to perform steps for each input string
-  const processInputString = async (inputString) => {
-    // Wait for the input field to be loaded
-    await page.waitForSelector('#tags');
-
-    // Type the text into the input field
-    await page.type('#tags', inputString);
-
-    // Wait for the dropdown to appear
-try {
-    await page.waitForSelector('.ui-menu-item', { visible: true, timeout: 5000 });
-} catch (error) {
-    console.log("No items found in dropdown menu");
-    return; // Exit the function if the dropdown does not appear
+BROWSERLESS_TIMEOUTS = {
+    'selector': BROWSERLESS_SELECTOR_TIMEOUT_MS,
+    'navigation': BROWSERLESS_NAVIGATION_TIMEOUT_MS,
+    'probe': BROWSERLESS_PROBE_TIMEOUT_MS,
+    'networkIdle': BROWSERLESS_NETWORK_IDLE_MS
 }
-    // Get all items in the dropdown
-const dropdownItems = await page.$$('.ui-menu-item');
-if (dropdownItems.length > 0) {
-    for (let i = 0; i < dropdownItems.length; i++) {
-        const dropdownText = await page.evaluate(el => el.innerText, dropdownItems[i]);
-        const dropdownItemSelector = 'li.ui-menu-item:nth-child(' + i+1 + ')';
-        await page.waitForTimeout(1500); // Adjust the timeout as necessary
-        await page.waitForSelector(dropdownItemSelector); // Ensure the item is visible
-
-        await page.waitForTimeout(1500); // Adjust the timeout as necessary
-
-        // Click the dropdown item using page.evaluate to avoid selection issues
-        await page.click(dropdownItemSelector)
-        console.log(`Dropdown item ${i + 1} clicked: ${dropdownText}`);
 
+# Idle SD sessions - the cookies returned by earlier Browserless runs, reused to skip the SAML login.
+# SD keeps the selected person in the session, so a run checks a session out and no two runs use the same one.
+sd_sessions = []
+sd_session_lock = threading.Lock()
 
-        // Wait for some time after each click to ensure the page processes it
-        await page.waitForTimeout(1500); // Adjust the timeout as necessary
-        await page.goto('https://www.silkeborgdata.dk/sdpw/faces/esdh/psag/PersonalesagLoader.xhtml?from=frontpage', {waitUntil: 'networkidle2'});
 
-        // Wait for the specific span element to be loaded
-        await page.waitForSelector('#psagform\\\\:sk\\\\:j_idt107\\\\:0\\\\:j_idt124\\\\:0\\\\:j_idt132');
+def checkout_sd_session():
+    # Returns the cookies of an idle SD session - empty if there is none, and the run logs in
+    with sd_session_lock:
+        return sd_sessions.pop() if sd_sessions else []
 
-        // Click the element
-        await page.click('#psagform\\\\:sk\\\\:j_idt107\\\\:0\\\\:j_idt124\\\\:0\\\\:j_idt132');
 
-        // Wait for rows to be processed
-        let rows = await processRows();
-
-        if (rows.length === 1) {
-        const [firstItem] = rows;
-        if( firstItem.navn === "" && firstItem.arkivdato === "")
-        {
-            // Wait for rows to be processed
-            rows = await processRows();
-        } 
-        }
-
-        // Log the extracted rows
-        console.log('Extracted Rows:', rows);
-
-        // Store the results
-        allResults.push({ inputString, dropdownText, result: rows });
-    }
-} else {
-    console.log("No dropdown item found.");
-}
-  };
+def checkin_sd_session(cookies):
+    # Makes the session idle again - at most one per concurrent run is kept
+    with sd_session_lock:
+        sd_sessions.append(cookies)
+        del sd_sessions[:-BROWSERLESS_MAX_CONCURRENCY]
 
-  // Perform initial login and navigation steps
-  await page.goto('https://sd.dk/start',{waitUntil: 'networkidle2' });
 
-  // Log in console when loaded
-  console.log("Page loaded");
+def read_browserless_response(response):
+    # Returns the data of a browserless function run, keeping the SD session it returned for a later run.
+    # The session of a failed run is dropped.
+    if response.status_code != 200:
+        logger.error(f"Request failed with status code: {response.status_code} and message: {response.content}")
+        return None
+    data = response.json()
+    cookies = data.pop('cookies', None) if isinstance(data, dict) else None
+    if cookies:
+        checkin_sd_session(cookies)
+    if isinstance(data, dict) and data.get('timings', None):
+        timings = ', '.join(f"{t.get('step')}: {t.get('ms')}" for t in data['timings'])
+        logger.info(f"Browserless timings (ms) - {timings}")
+    return data
 
-  // Wait for the button to be available
-  await page.waitForSelector('#arbejdspladsButton', { timeout: 5000 });
-  console.log("arbejdspladsButton found");
 
-  // Click the button with the id "arbejdspladsButton"
-  await page.click('#arbejdspladsButton');
-  console.log("Button clicked and navigation completed");
+def load_script(name):
+    # Reads a browserless script, replacing "// @include <file>" lines with that file indented to match
+    with open(os.path.join(SCRIPTS_DIR, name), encoding='utf-8') as f:
+        script = f.read()
 
-  // Wait for the iframe to be loaded
-  await page.waitForSelector('iframe');  // Adjust the selector to target the specific iframe if necessary
+    def include(match):
+        indent = match.group(1)
+        included = load_script(match.group(2)).rstrip('\n')
+        return '\n'.join(indent + line if line else line for line in included.split('\n'))
 
-  // Get the iframe element
-  const iframeElement = await page.$('iframe');  // Adjust the selector to target the specific iframe if necessary
-  const iframe = await iframeElement.contentFrame();
+    return re.sub(r'^([ \t]*)// @include (\S+)[ \t]*$', include, script, flags=re.MULTILINE)
 
-  // Wait for the select element to be loaded inside the iframe
-  await iframe.waitForSelector('#oiosaml-idp');
 
-  // Get the value of the option with text 'Randers Kommune' inside the iframe
-  const value = await iframe.evaluate(() => {
-      const options = document.querySelectorAll('#oiosaml-idp option');
-      for (const option of options) {
-          if (option.textContent.trim() === 'Randers Kommune') {
-              return option.value;
-          }
-      }
-      return null;
-  });
+# The scripts are constant - all parameters are passed in the browserless context
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'browserless_scripts')
+PERSONALESAG_FILES_SCRIPT = load_script('personalesag_files.js')
+PERSONALESAG_EXIST_SCRIPT = load_script('personalesag_exist.js')
 
-  // Print the value
-  console.log(value);
 
-  await page.goto("https://sd.dk/" + value);
-
-  // Log a message indicating the button was clicked
-  console.log("Button clicked and navigation completed");
-
-  // Wait for the username input field to be available
-  await page.waitForSelector('#userNameInput');
-
-  // Type the username
-  await page.type('#userNameInput', """ + "'" + f"{SD_PERSONALESAG_ROBOT_USERNAME}" + "'" + """);
-
-  // Wait for the password input field to be available
-  await page.waitForSelector('#passwordInput');
-
-  // Type the password
-  await page.type('#passwordInput', """ + "'" + f"{SD_PERSONALESAG_ROBOT_PASSWORD}" + "'" + """); 
-
-  // Click the submit button
-  await page.click('#submitButton');
-
-  // Log a message indicating the login was attempted
-  console.log("Login attempted");
-
-  // Wait for some time after selection
-  await page.waitForTimeout(1500); // Adjust the timeout as necessary
-
-  // Wait for the username input field to be available
-  await page.waitForSelector('#product-cf662da2-9d3c-0108-e043-0a10f6400108');
-  await page.goto('https://www.silkeborgdata.dk/sdpw/' ,{waitUntil: 'networkidle2' });
-
-  // Store the results for each input string
-  let allResults = [];
-
-  for (let inputString of inputStrings) {
-    await processInputString(inputString);
-    //await page.goto('https://www.silkeborgdata.dk/sdpw/' ,{waitUntil: 'networkidle2' });
-  }
-  // Close the page
-  //await page.close();
-    return {
-        data: {
-        allResults
-        },
-        type: 'application/json'
-    };
-
-};
-    """
-
-    response = requests.post(url, headers=headers, data=data, auth=HTTPBasicAuth(username=BROWSERLESS_CLIENT_ID,
-                                                                                 password=BROWSERLESS_CLIENT_SECRET))
-    return response
-
-
-def browserless_sd_personalesag_exist(input_string):
-    # url = "https://browserless.prototypes.randers.dk/function"
+def run_browserless_function(code, context, priority=PRIORITY_FILES):
     url = BROWSERLESS_URL + "/function"
-    headers = {"Content-Type": "application/javascript", }
-
-    data = """
-    
-    // Full TypeScript support for both puppeteer and the DOM
-    module.exports = async ({ page }) => {
-
-    const inputString = """ + f"'{input_string}'" + """
-
-    // Perform initial login and navigation steps
-    await page.goto('https://sd.dk/start',{waitUntil: 'networkidle2' });
-
-    // Log in console when loaded
-    console.log("Page loaded");
-
-    // Wait for the button to be available
-    await page.waitForSelector('#arbejdspladsButton', { timeout: 5000 });
-    console.log("arbejdspladsButton found");
-
-    // Click the button with the id "arbejdspladsButton"
-    await page.click('#arbejdspladsButton');
-    console.log("Button clicked and navigation completed");
-
-    // Wait for the iframe to be loaded
-    await page.waitForSelector('iframe');  // Adjust the selector to target the specific iframe if necessary
-
-    // Get the iframe element
-    const iframeElement = await page.$('iframe');  // Adjust the selector to target the specific iframe if necessary
-    const iframe = await iframeElement.contentFrame();
-
-    // Wait for the select element to be loaded inside the iframe
-    await iframe.waitForSelector('#oiosaml-idp');
-
-    // Get the value of the option with text 'Randers Kommune' inside the iframe
-    const value = await iframe.evaluate(() => {
-        const options = document.querySelectorAll('#oiosaml-idp option');
-        for (const option of options) {
-            if (option.textContent.trim() === 'Randers Kommune') {
-                return option.value;
-            }
-        }
-        return null;
-    });
-
-    // Print the value
-    console.log(value);
-
-    await page.goto("https://sd.dk/" + value);
-
-    // Log a message indicating the button was clicked
-    console.log("Button clicked and navigation completed");
-
-    // Wait for the username input field to be available
-    await page.waitForSelector('#userNameInput');
-
-    // Type the username
-    await page.type('#userNameInput',""" + "'" + f"{SD_PERSONALESAG_ROBOT_USERNAME}" + "'" + """);
-
-    // Wait for the password input field to be available
-    await page.waitForSelector('#passwordInput');
-
-    // Type the password
-    await page.type('#passwordInput', """ + "'" + f"{SD_PERSONALESAG_ROBOT_PASSWORD}" + "'" + """);
-
-    // Click the submit button
-    await page.click('#submitButton');
-
-    // Log a message indicating the login was attempted
-    console.log("Login attempted");
-
-    // Wait for some time after selection
-    await page.waitForTimeout(1500); // Adjust the timeout as necessary
-
-        // Wait for the username input field to be available
-    await page.waitForSelector('#product-cf662da2-9d3c-0108-e043-0a10f6400108');
-    await page.goto('https://www.silkeborgdata.dk/sdpw/' ,{waitUntil: 'networkidle2' });
-
-    await page.waitForSelector('#tags');
-
-    // Type the text into the input field
-    await page.type('#tags', inputString);
-
-    try {
-        await page.waitForSelector('.ui-menu-item', { visible: true, timeout: 5000 });
-    } catch (error) {
-        console.log("No items found in dropdown menu");
-        return {
-            data: {
-            "success": false,
-            "msg": "No dropdown item found."
-            },
-            type: "application/json",
-        };
+    context = {
+        'timeouts': BROWSERLESS_TIMEOUTS,
+        'username': SD_PERSONALESAG_ROBOT_USERNAME,
+        'password': SD_PERSONALESAG_ROBOT_PASSWORD,
+        **context
     }
+    # Raises LimiterTimeout if no slot frees up within BROWSERLESS_QUEUE_TIMEOUT
+    with limiter.slot(priority) as queue_wait:
+        if queue_wait >= 1:
+            logger.info(f"Browserless run waited {queue_wait:.1f} seconds in queue")
+        # The session is checked out after the wait, so a run finishing meanwhile can hand over its SD session
+        context['cookies'] = checkout_sd_session()
+        response = session.post(url, json={'code': code, 'context': context},
+                                auth=HTTPBasicAuth(username=BROWSERLESS_CLIENT_ID, password=BROWSERLESS_CLIENT_SECRET))
+        return read_browserless_response(response)
 
-    const dropdownItems = await page.$$('.ui-menu-item');
-    if (dropdownItems.length > 0) {
-        for (let i = 0; i < dropdownItems.length; i++) {
-            const dropdownText = await page.evaluate(el => el.innerText, dropdownItems[i]);
-            const dropdownItemSelector = 'li.ui-menu-item:nth-child(' + i+1 + ')';
-            await page.waitForTimeout(2500); // Adjust the timeout as necessary
-            await page.waitForSelector(dropdownItemSelector); // Ensure the item is visible
-
-            await page.waitForTimeout(2500); // Adjust the timeout as necessary
-
-            // Click the dropdown item using page.evaluate to avoid selection issues
-            await page.click(dropdownItemSelector)
-            console.log(`Dropdown item ${i + 1} clicked: ${dropdownText}`);
 
+def browserless_metrics():
+    return limiter.metrics()
 
-            // Wait for some time after each click to ensure the page processes it
-            await page.waitForTimeout(2500); // Adjust the timeout as necessary
-            await page.goto('https://www.silkeborgdata.dk/sdpw/faces/esdh/psag/PersonalesagLoader.xhtml?from=frontpage', {waitUntil: 'networkidle2'});
-
-
-            page.waitForSelector('#sager')
-
-
-
-
-            var success = await page.evaluate(() => {
-
-            const elements = document.querySelectorAll("[id^='psagform']");
-
-            let found = false
-
-
-
-            elements.forEach((el) => {
-                if(el.innerHTML === "Personalesag"){
-                found = true
-                }
-                })
-
-                return found
-            })
-
-            const msg = success ? "Personalesag found." : "Did not find personalesag."
-
-            await page.close();
-
-            return {
-                data: {
-                    "success": success,
-                    "msg": msg
-                },
-                type: "application/json",
-                };
-            }
-
-    } else {
-        console.log("No dropdown item found.");
-        return {
-            data: {
-            "success": false,
-            "msg": "No dropdown item found."
-            },
-            type: "application/json",
-        };
-    }
-    };
 
+def browserless_sd_personalesag_files(input_strings):
+    # Input strings should be a list of strings with cpr and employmentidentifier e.g. ['0102039999 01010']
+    return run_browserless_function(PERSONALESAG_FILES_SCRIPT, {'inputStrings': list(input_strings)}, PRIORITY_FILES)
 
-    """
 
-    response = requests.post(url, headers=headers, data=data, auth=HTTPBasicAuth(username=BROWSERLESS_CLIENT_ID,
-                                                                                 password=BROWSERLESS_CLIENT_SECRET))
-    logger.info(response.content)
-    return response
+def browserless_sd_personalesag_exist(input_strings):
+    # Input strings should be a list of strings with cpr and employmentidentifier e.g. ['0102039999 01010']
+    # All input strings are checked in one browserless run, sharing one SD login
+    # Existence checks block journalisation of uploads, so they go before file fetches
+    result = run_browserless_function(PERSONALESAG_EXIST_SCRIPT, {'inputStrings': list(input_strings)}, PRIORITY_EXIST)
+    logger.info(result)
+    return result
@@ -0,0 +1,86 @@
+// Full TypeScript support for both puppeteer and the DOM
+module.exports = async ({ page, context }) => {
+
+    // Array of input strings
+    const inputStrings = context.inputStrings;
+
+    // @include sd_session.js
+
+    // Check if SD has a personalesag for a single input string, starting from the SD front page
+    const checkInputString = async (inputString) => {
+        await page.waitForSelector('#tags');
+
+        // Type the text into the input field
+        await page.type('#tags', inputString);
+
+        try {
+            await page.waitForSelector('.ui-menu-item', { visible: true, timeout: timeouts.probe });
+        } catch (error) {
+            console.log("No items found in dropdown menu");
+            return { "success": false, "msg": "No dropdown item found." };
+        }
+
+        const dropdownItems = await page.$$('.ui-menu-item');
+        if (dropdownItems.length === 0) {
+            console.log("No dropdown item found.");
+            return { "success": false, "msg": "No dropdown item found." };
+        }
+
+        // Only the first dropdown item is used
+        const dropdownText = await page.evaluate(el => el.innerText, dropdownItems[0]);
+        const dropdownItemSelector = 'li.ui-menu-item:nth-child(1)';
+        await page.waitForSelector(dropdownItemSelector, { visible: true }); // Ensure the item is visible
+
+        // Click the dropdown item using page.evaluate to avoid selection issues
+        await page.click(dropdownItemSelector)
+        console.log(`Dropdown item 1 clicked: ${dropdownText}`);
+
+        // Wait for SD to process the selection
+        await waitForNetworkIdle();
+        mark('select ' + inputString);
+        await page.goto('https://www.silkeborgdata.dk/sdpw/faces/esdh/psag/PersonalesagLoader.xhtml?from=frontpage', {waitUntil: 'networkidle2'});
+        mark('personalesag ' + inputString);
+
+        const success = await page.evaluate(() => {
+            const elements = document.querySelectorAll("[id^='psagform']");
+            let found = false
+            elements.forEach((el) => {
+                if(el.innerHTML === "Personalesag"){
+                    found = true
+                }
+            })
+            return found
+        })
+
+        const msg = success ? "Personalesag found." : "Did not find personalesag."
+        return { "success": success, "msg": msg };
+    };
+
+    // Log in, or reuse the SD session from an earlier run
+    await ensureLoggedIn();
+
+    let results = [];
+    for (let i = 0; i < inputStrings.length; i++) {
+        const inputString = inputStrings[i];
+        if (i > 0) {
+            // Start the next lookup from the SD front page
+            await page.goto('https://www.silkeborgdata.dk/sdpw/' ,{waitUntil: 'networkidle2' });
+        }
+        try {
+            const result = await checkInputString(inputString);
+            results.push({ inputString, ...result });
+        } catch (error) {
+            console.log(`Error checking ${inputString}: ${error}`);
+            results.push({ inputString, "success": false, "msg": `Error: ${error.message}` });
+        }
+    }
+
+    return {
+        data: {
+            "results": results,
+            "timings": timings,
+            "cookies": await sessionCookies()
+        },
+        type: "application/json",
+    };
+};
@@ -0,0 +1,132 @@
+module.exports = async ({ page, context }) => {
+
+    // Array of input strings
+  const inputStrings = context.inputStrings;
+
+  // @include sd_session.js
+
+ const processRows = async () =>
+    {
+        // Wait for the table wrapper to ensure the table is visible
+        await page.waitForSelector('#psagform\\:sk\\:j_idt107\\:0\\:j_idt124\\:0\\:table1\\:table1_data', { visible: true });
+
+        // Wait until the table rows have been rendered with content
+        try {
+            await page.waitForFunction(() => {
+                const rows = document.querySelectorAll('#psagform\\:sk\\:j_idt107\\:0\\:j_idt124\\:0\\:table1\\:table1_data tr');
+                return Array.from(rows).some(row => row.innerText.trim() !== '');
+            }, { timeout: timeouts.selector });
+        } catch (error) {
+            console.log("Table rows did not get any content in time");
+        }
+
+        // Extract text from each row
+        const rows = await page.evaluate(() => {
+            // Get all rows in the table body
+            const rows = document.querySelectorAll('#psagform\\:sk\\:j_idt107\\:0\\:j_idt124\\:0\\:table1\\:table1_data tr');
+            let rowData = [];
+
+            // Iterate through each row
+            rows.forEach(row => {
+                // Extract text from each cell
+                const cells = row.querySelectorAll('td[role="gridcell"]');
+                if (cells.length > 0) {
+                    // Extract 'Navn' and 'Arkivdato' based on their column positions
+                    const navn = cells[3] ? cells[3].innerText.trim() : '';  // Column for 'Navn'
+                    const arkivdato = cells[8] ? cells[8].innerText.trim() : '';  // Column for 'Arkivdato'
+
+                    // Add row data
+                    rowData.push({ navn, arkivdato });
+                }
+            });
+            console.log("rowData: " + rowData)
+            return rowData;
+        });
+        return rows;
+    }
+
+  // Function to perform steps for each input string
+  const processInputString = async (inputString) => {
+    // Wait for the input field to be loaded
+    await page.waitForSelector('#tags');
+
+    // Type the text into the input field
+    await page.type('#tags', inputString);
+
+    // Wait for the dropdown to appear
+try {
+    await page.waitForSelector('.ui-menu-item', { visible: true, timeout: timeouts.probe });
+} catch (error) {
+    console.log("No items found in dropdown menu");
+    return; // Exit the function if the dropdown does not appear
+}
+    // Get all items in the dropdown
+const dropdownItems = await page.$$('.ui-menu-item');
+if (dropdownItems.length > 0) {
+    for (let i = 0; i < dropdownItems.length; i++) {
+        const dropdownText = await page.evaluate(el => el.innerText, dropdownItems[i]);
+        const dropdownItemSelector = 'li.ui-menu-item:nth-child(' + (i + 1) + ')';
+        await page.waitForSelector(dropdownItemSelector, { visible: true }); // Ensure the item is visible
+
+        // Click the dropdown item using page.evaluate to avoid selection issues
+        await page.click(dropdownItemSelector)
+        console.log(`Dropdown item ${i + 1} clicked: ${dropdownText}`);
+
+        // Wait for SD to process the selection
+        await waitForNetworkIdle();
+        mark('select ' + inputString);
+        await page.goto('https://www.silkeborgdata.dk/sdpw/faces/esdh/psag/PersonalesagLoader.xhtml?from=frontpage', {waitUntil: 'networkidle2'});
+
+        // Wait for the specific span element to be loaded
+        await page.waitForSelector('#psagform\\:sk\\:j_idt107\\:0\\:j_idt124\\:0\\:j_idt132');
+
+        // Click the element
+        await page.click('#psagform\\:sk\\:j_idt107\\:0\\:j_idt124\\:0\\:j_idt132');
+
+        // Wait for rows to be processed
+        let rows = await processRows();
+
+        if (rows.length === 1) {
+        const [firstItem] = rows;
+        if( firstItem.navn === "" && firstItem.arkivdato === "")
+        {
+            // Wait for rows to be processed
+            rows = await processRows();
+        } 
+        }
+
+        // Log the extracted rows
+        console.log('Extracted Rows:', rows);
+        mark('rows ' + inputString);
+
+        // Store the results
+        allResults.push({ inputString, dropdownText, result: rows });
+    }
+} else {
+    console.log("No dropdown item found.");
+}
+  };
+
+  // Log in, or reuse the SD session from an earlier run
+  await ensureLoggedIn();
+
+  // Store the results for each input string
+  let allResults = [];
+
+  for (let inputString of inputStrings) {
+    await processInputString(inputString);
+    //await page.goto('https://www.silkeborgdata.dk/sdpw/' ,{waitUntil: 'networkidle2' });
+  }
+  // Close the page
+  //await page.close();
+    return {
+        data: {
+        allResults,
+        timings,
+        cookies: await sessionCookies()
+        },
+        type: 'application/json'
+    };
+
+};
+    
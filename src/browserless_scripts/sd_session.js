@@ -0,0 +1,127 @@
+// Shared SD session handling, included at the top of the browserless functions.
+// Expects page and context (timeouts, cookies, username, password) in scope.
+
+// Upper bounds for waiting on SD - waits end as soon as the page is ready
+const timeouts = context.timeouts;
+page.setDefaultTimeout(timeouts.selector);
+page.setDefaultNavigationTimeout(timeouts.navigation);
+
+// Time spent per step, returned with the result
+const timings = [];
+let lastMark = Date.now();
+const mark = (step) => {
+  const now = Date.now();
+  timings.push({ step, ms: now - lastMark });
+  lastMark = now;
+};
+
+// Wait until SD has finished its requests, e.g. after selecting a dropdown item
+const waitForNetworkIdle = async () => {
+  try {
+    await page.waitForNetworkIdle({ idleTime: timeouts.networkIdle, timeout: timeouts.navigation });
+  } catch (error) {
+    console.log("Network did not become idle in time");
+  }
+};
+
+// SD session cookies from an earlier run
+const savedCookies = context.cookies || [];
+
+// Only cookies of these domains are kept - the cookies of the identity provider are left out
+const sdCookieDomains = ['silkeborgdata.dk', 'sd.dk'];
+const isSdCookie = ({ domain }) => {
+  const host = domain.replace(/^\./, '');
+  return sdCookieDomains.some((sdDomain) => host === sdDomain || host.endsWith('.' + sdDomain));
+};
+
+// The SD cookies of the browser, so the next run can reuse the SD session
+const sessionCookies = async () => {
+  const client = await page.target().createCDPSession();
+  const { cookies } = await client.send('Network.getAllCookies');
+  return cookies.filter(isSdCookie).map(({ name, value, domain, path, expires, httpOnly, secure, sameSite }) => ({ name, value, domain, path, expires, httpOnly, secure, sameSite }));
+};
+
+const login = async () => {
+  // Perform initial login and navigation steps
+  await page.goto('https://sd.dk/start',{waitUntil: 'networkidle2' });
+
+  // Log in console when loaded
+  console.log("Page loaded");
+
+  // Wait for the button to be available
+  await page.waitForSelector('#arbejdspladsButton', { timeout: timeouts.selector });
+  console.log("arbejdspladsButton found");
+
+  // Click the button with the id "arbejdspladsButton"
+  await page.click('#arbejdspladsButton');
+  console.log("Button clicked and navigation completed");
+
+  // Wait for the iframe to be loaded
+  await page.waitForSelector('iframe');  // Adjust the selector to target the specific iframe if necessary
+
+  // Get the iframe element
+  const iframeElement = await page.$('iframe');  // Adjust the selector to target the specific iframe if necessary
+  const iframe = await iframeElement.contentFrame();
+
+  // Wait for the select element to be loaded inside the iframe
+  await iframe.waitForSelector('#oiosaml-idp');
+
+  // Get the value of the option with text 'Randers Kommune' inside the iframe
+  const value = await iframe.evaluate(() => {
+      const options = document.querySelectorAll('#oiosaml-idp option');
+      for (const option of options) {
+          if (option.textContent.trim() === 'Randers Kommune') {
+              return option.value;
+          }
+      }
+      return null;
+  });
+
+  // Print the value
+  console.log(value);
+
+  await page.goto("https://sd.dk/" + value);
+
+  // Log a message indicating the button was clicked
+  console.log("Button clicked and navigation completed");
+
+  // Wait for the username input field to be available
+  await page.waitForSelector('#userNameInput');
+
+  // Type the username
+  await page.type('#userNameInput', context.username);
+
+  // Wait for the password input field to be available
+  await page.waitForSelector('#passwordInput');
+
+  // Type the password
+  await page.type('#passwordInput', context.password);
+
+  // Click the submit button
+  await page.click('#submitButton');
+
+  // Log a message indicating the login was attempted
+  console.log("Login attempted");
+
+  // Wait for the SD product page after the login redirects
+  await page.waitForSelector('#product-cf662da2-9d3c-0108-e043-0a10f6400108');
+};
+
+// Go to the SD front page, logging in only if there is no saved session or it has expired
+const ensureLoggedIn = async () => {
+  if (savedCookies.length > 0) {
+    await page.setCookie(...savedCookies);
+    await page.goto('https://www.silkeborgdata.dk/sdpw/' ,{waitUntil: 'networkidle2' });
+    try {
+      await page.waitForSelector('#tags', { timeout: timeouts.probe });
+      console.log("Reusing SD session");
+      mark('reuse session');
+      return;
+    } catch (error) {
+      console.log("SD session expired - logging in");
+    }
+  }
+  await login();
+  await page.goto('https://www.silkeborgdata.dk/sdpw/' ,{waitUntil: 'networkidle2' });
+  mark('login');
+};
@@ -0,0 +1,119 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+# Thread-safe cache where entries expire after ttl seconds.
+# Concurrent loads of the same key are deduplicated, so only one caller runs the loader.
+class TTLCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            return None
+
+    def get_or_load(self, key, loader):
+        while True:
+            with self.lock:
+                entry = self.entries.get(key, None)
+                if entry and entry[0] > time.monotonic():
+                    self.hits += 1
+                    return entry[1]
+                event = self.loading.get(key, None)
+                if not event:
+                    # This caller loads the value, others wait for it
+                    event = threading.Event()
+                    self.loading[key] = event
+                    self.misses += 1
+                    break
+                self.coalesced += 1
+            event.wait()
+
+        try:
+            value = loader()
+            # Empty results are not cached, so a failed load is retried by the next caller
+            if value:
+                self.set(key, value)
+            return value
+        finally:
+            with self.lock:
+                self.loading.pop(key, None)
+            event.set()
+
+    def record_miss(self):
+        # For callers loading values themselves, e.g. coroutines that can't wait in get_or_load
+        with self.lock:
+            self.misses += 1
+
+    def record_coalesced(self):
+        # For callers waiting for a load started by another caller
+        with self.lock:
+            self.coalesced += 1
+
+    def set(self, key, value):
+        with self.lock:
+            now = time.monotonic()
+            for expired_key in [k for k, entry in self.entries.items() if entry[0] <= now]:
+                del self.entries[expired_key]
+            self.entries[key] = (now + self.ttl, value)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced, 'size': len(self.entries)}
+
+
+# Thread-safe cache holding at most maxsize entries, evicting the least recently used
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
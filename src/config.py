@@ -19,6 +19,8 @@ SBSYS_CLIENT_ID = os.environ["SBSYS_CLIENT_ID"].strip()
 SBSYS_CLIENT_SECRET = os.environ["SBSYS_CLIENT_SECRET"].strip()
 SBSYS_USERNAME = os.environ["SBSYS_USERNAME"].strip()
 SBSYS_PASSWORD = os.environ["SBSYS_PASSWORD"].strip()
+SBSYS_TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv('SBSYS_TOKEN_REFRESH_MARGIN_SECONDS', '30').strip())
+SBSYS_PERSONALESAG_CACHE_TTL_SECONDS = int(os.getenv('SBSYS_PERSONALESAG_CACHE_TTL_SECONDS', '120').strip())
 
 # Database
 DB_NAME = os.environ["DB_NAME"].strip()
@@ -26,17 +28,70 @@ DB_USER = os.environ["DB_USER"].strip()
 DB_PASSWORD = os.environ["DB_PASSWORD"].strip()
 DB_HOST = os.environ["DB_HOST"].strip()
 DB_PORT = os.environ["DB_PORT"].strip()
+# upgrade: apply pending migrations at startup, check: only verify the schema version, off: skip
+DB_MIGRATION_MODE = os.getenv('DB_MIGRATION_MODE', 'upgrade').strip().lower()
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5').strip())
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10').strip())
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30').strip())
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'True') in ['True', 'true']
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800').strip())
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '60000').strip())
+DB_APPLICATION_NAME = os.getenv('DB_APPLICATION_NAME', 'sbsys-ekstern').strip()
 
 # Browserless
 BROWSERLESS_URL = os.environ["BROWSERLESS_URL"].strip().rstrip('/')
 BROWSERLESS_CLIENT_ID = os.environ["BROWSERLESS_CLIENT_ID"].strip()
 BROWSERLESS_CLIENT_SECRET = os.environ["BROWSERLESS_CLIENT_SECRET"].strip()
+BROWSERLESS_READ_TIMEOUT = float(os.getenv('BROWSERLESS_READ_TIMEOUT', '300').strip())
+BROWSERLESS_SELECTOR_TIMEOUT_MS = int(os.getenv('BROWSERLESS_SELECTOR_TIMEOUT_MS', '15000').strip())
+BROWSERLESS_NAVIGATION_TIMEOUT_MS = int(os.getenv('BROWSERLESS_NAVIGATION_TIMEOUT_MS', '30000').strip())
+# Wait for elements that may never appear, e.g. dropdown items or the page of a reused session
+BROWSERLESS_PROBE_TIMEOUT_MS = int(os.getenv('BROWSERLESS_PROBE_TIMEOUT_MS', '5000').strip())
+BROWSERLESS_NETWORK_IDLE_MS = int(os.getenv('BROWSERLESS_NETWORK_IDLE_MS', '500').strip())
+BROWSERLESS_MAX_CONCURRENCY = int(os.getenv('BROWSERLESS_MAX_CONCURRENCY', '2').strip())
+BROWSERLESS_QUEUE_TIMEOUT = float(os.getenv('BROWSERLESS_QUEUE_TIMEOUT', '600').strip())
 
 # SD
 SD_USERNAME = os.environ["SD_USERNAME"].strip()
 SD_PASSWORD = os.environ["SD_PASSWORD"].strip()
 SD_URL = os.environ["SD_URL"].strip()
+SD_DEPARTMENT_CACHE_TTL_SECONDS = int(os.getenv('SD_DEPARTMENT_CACHE_TTL_SECONDS', '3600').strip())
 
 # SD personalesag robot
 SD_PERSONALESAG_ROBOT_USERNAME = os.environ["SD_PERSONALESAG_ROBOT_USERNAME"].strip()
-SD_PERSONALESAG_ROBOT_PASSWORD = os.environ["SD_PERSONALESAG_ROBOT_PASSWORD"].strip()
\ No newline at end of file
+SD_PERSONALESAG_ROBOT_PASSWORD = os.environ["SD_PERSONALESAG_ROBOT_PASSWORD"].strip()
+
+# Sag and delforloeb per employment remembered in memory
+PERSONALESAG_MAPPING_CACHE_SIZE = int(os.getenv('PERSONALESAG_MAPPING_CACHE_SIZE', '1000').strip())
+
+# Worker
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', '1').strip())
+# Most uploads claimed at a time - a worker claims the oldest upload and the uploads queued for the same employment, which share one sag lookup
+WORKER_BATCH_SIZE = int(os.getenv('WORKER_BATCH_SIZE', '10').strip())
+WORKER_ERROR_SLEEP_SECONDS = float(os.getenv('WORKER_ERROR_SLEEP_SECONDS', '5').strip())
+WORKER_IDLE_MIN_SECONDS = float(os.getenv('WORKER_IDLE_MIN_SECONDS', '0.5').strip())
+WORKER_IDLE_MAX_SECONDS = float(os.getenv('WORKER_IDLE_MAX_SECONDS', '30').strip())
+# Threads running the SD and SBSYS lookups of the workers concurrently, and how long a lookup may take
+LOOKUP_THREADS = int(os.getenv('LOOKUP_THREADS', str(3 * WORKER_COUNT)).strip())
+LOOKUP_TIMEOUT_SECONDS = float(os.getenv('LOOKUP_TIMEOUT_SECONDS', '180').strip())
+
+# Retries of FAILED_TRY_AGAIN uploads - the delay doubles for every attempt up to RETRY_MAX_DELAY_SECONDS
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '8').strip())
+RETRY_BASE_DELAY_SECONDS = float(os.getenv('RETRY_BASE_DELAY_SECONDS', '60').strip())
+RETRY_MAX_DELAY_SECONDS = float(os.getenv('RETRY_MAX_DELAY_SECONDS', '3600').strip())
+RETRY_CHECK_SECONDS = float(os.getenv('RETRY_CHECK_SECONDS', '30').strip())
+
+# SD department index
+DEPARTMENT_INDEX_REFRESH_SECONDS = int(os.getenv('DEPARTMENT_INDEX_REFRESH_SECONDS', '43200').strip())
+DEPARTMENT_INDEX_CHECK_SECONDS = int(os.getenv('DEPARTMENT_INDEX_CHECK_SECONDS', '300').strip())
+
+# Retention - the files of SUCCESS and FAILED uploads are removed after RETENTION_DAYS. Off by default, 0 keeps them
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', '0').strip())
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '20').strip())
+RETENTION_CHECK_SECONDS = int(os.getenv('RETENTION_CHECK_SECONDS', '3600').strip())
+
+# HTTP connection pools
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', '10').strip())
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '10').strip())
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '10').strip())
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '120').strip())
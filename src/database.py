@@ -1,13 +1,26 @@
+import io
+import random
 import sqlalchemy
 import logging
+import select
+import threading
+import time
 import uuid
 
+from contextlib import contextmanager
 from enum import Enum as ENUM
 from datetime import datetime, timedelta
 
-from sqlalchemy import Column, String, Enum, LargeBinary, DateTime
-from sqlalchemy.orm import Session, DeclarativeBase
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, Enum, LargeBinary, DateTime, Integer, BigInteger, Index
+from sqlalchemy.orm import Session, DeclarativeBase, object_session, deferred, load_only
+from sqlalchemy.dialects.postgresql import UUID, JSONB, insert
+from sqlalchemy.pool import QueuePool
+
+
+SIGNATUR_FILEUPLOAD_CHANNEL = 'signatur_fileupload'
+
+# Uploaded files are copied to and from Postgres large objects in chunks of this size
+LARGE_OBJECT_CHUNK_SIZE = 1024 * 1024
 
 
 class STATUS_CODE(ENUM):
@@ -19,17 +32,124 @@ class STATUS_CODE(ENUM):
 
 
 class FileObject:
-    def __init__(self, file_data, file_name, mimetype):
+    def __init__(self, file_data, file_name, mimetype, size=None):
         self.stream = file_data
         self.filename = file_name
         self.mimetype = mimetype
+        self.size = size
 
     def __repr__(self):
         return f"FileObject(filename={self.filename}, mimetype={self.mimetype})"
 
 
+def get_dbapi_connection(session):
+    # The psycopg2 connection behind the session's current transaction
+    return session.connection().connection.dbapi_connection
+
+
+# Read-only file object over a Postgres large object - only usable while the session's transaction is open
+class LargeObjectReader(io.RawIOBase):
+    def __init__(self, session, oid):
+        self.session = session
+        self.oid = oid
+        self.lobject = None
+
+    def open(self):
+        if self.lobject is None:
+            self.lobject = get_dbapi_connection(self.session).lobject(self.oid, 'rb')
+        return self.lobject
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.readall()
+        return self.open().read(size)
+
+    def readall(self):
+        # Reads up to the end of the large object in chunks
+        chunks = []
+        chunk = self.open().read(LARGE_OBJECT_CHUNK_SIZE)
+        while chunk:
+            chunks.append(chunk)
+            chunk = self.open().read(LARGE_OBJECT_CHUNK_SIZE)
+        return b''.join(chunks)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.open().seek(offset, whence)
+
+    def tell(self):
+        return self.open().tell()
+
+    def close(self):
+        if self.lobject is not None and not self.lobject.closed:
+            self.lobject.close()
+        self.lobject = None
+        super().close()
+
+
+def received_uploads_query(session):
+    # RECEIVED uploads in queue order, locking them and skipping rows locked by others - uses ix_signatur_fileupload_received_updated_at
+    return session.query(SignaturFileupload).filter(SignaturFileupload.status == STATUS_CODE.RECEIVED).order_by(SignaturFileupload.updated_at.asc()).with_for_update(skip_locked=True)
+
+
+def stuck_uploads_query(session):
+    # Uploads in PROCESSING for more than an hour - uses ix_signatur_fileupload_status_updated_at
+    return session.query(SignaturFileupload).filter(SignaturFileupload.status == STATUS_CODE.PROCESSING).filter(SignaturFileupload.updated_at < datetime.now() - timedelta(seconds=3600))
+
+
+# QueuePool that records how long callers wait to check out a connection
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def _do_get(self):
+        start = time.monotonic()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except sqlalchemy.exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            wait = time.monotonic() - start
+            with self.stats_lock:
+                self.checkouts += 1
+                self.checkout_timeouts += timed_out
+                self.checkout_wait_total += wait
+                self.checkout_wait_max = max(self.checkout_wait_max, wait)
+
+    def metrics(self):
+        with self.stats_lock:
+            return {
+                'size': self.size(),
+                'checked_in': self.checkedin(),
+                'checked_out': self.checkedout(),
+                'overflow': self.overflow(),
+                'checkouts': self.checkouts,
+                'checkout_timeouts': self.checkout_timeouts,
+                'checkout_wait_avg': self.checkout_wait_total / self.checkouts if self.checkouts else 0.0,
+                'checkout_wait_max': self.checkout_wait_max
+            }
+
+
 class DatabaseClient:
-    def __init__(self, db_type, database, username, password, host, port=None):
+    def __init__(self, db_type, database, username, password, host, port=None, pool_size=5, max_overflow=10, pool_timeout=30,
+                 pool_pre_ping=True, pool_recycle=1800, statement_timeout_ms=None, application_name=None):
         if db_type.lower() == 'mssql':
             driver = 'mssql+pymssql'
         elif db_type.lower() == 'mariadb':
@@ -44,10 +164,23 @@ class DatabaseClient:
         if port:
             host = host + f':{port}'
 
-        self.engine = sqlalchemy.create_engine(f'{driver}://{username}:{password}@{host}/{database}')
+        connect_args = {}
+        if driver == 'postgresql+psycopg2':
+            if statement_timeout_ms:
+                connect_args['options'] = f'-c statement_timeout={int(statement_timeout_ms)}'
+            if application_name:
+                connect_args['application_name'] = application_name
+
+        # pre_ping replaces connections broken by a database restart, recycle replaces connections older than pool_recycle seconds
+        self.engine = sqlalchemy.create_engine(f'{driver}://{username}:{password}@{host}/{database}', poolclass=TimedQueuePool,
+                                               pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout,
+                                               pool_pre_ping=pool_pre_ping, pool_recycle=pool_recycle, connect_args=connect_args)
 
     def get_engine(self):
         return self.engine
+
+    def pool_metrics(self):
+        return self.engine.pool.metrics()
     
     def get_connection(self):
         try:
@@ -74,6 +207,66 @@ class DatabaseClient:
         except Exception as e:
             self.logger.error(f"Error executing SQL: {e}")
 
+    def notify(self, channel, payload=''):
+        try:
+            with self.get_connection() as conn:
+                conn.execute(sqlalchemy.text("SELECT pg_notify(:channel, :payload)"), {'channel': channel, 'payload': payload})
+                conn.commit()
+        except Exception as e:
+            self.logger.error(f"Error sending notification on channel {channel}: {e}")
+
+    @contextmanager
+    def try_advisory_lock(self, key):
+        # Yields whether the session level advisory lock was taken - it is released when the block exits.
+        # If the database can't be reached the block runs without the lock.
+        conn = None
+        locked = False
+        try:
+            conn = self.get_connection().execution_options(isolation_level='AUTOCOMMIT')
+            locked = conn.execute(sqlalchemy.text("SELECT pg_try_advisory_lock(:key)"), {'key': key}).scalar()
+            acquired = locked
+        except Exception as e:
+            self.logger.error(f"Error taking advisory lock {key}: {e}")
+            acquired = True
+        try:
+            yield acquired
+        finally:
+            if conn is not None:
+                try:
+                    if locked:
+                        conn.execute(sqlalchemy.text("SELECT pg_advisory_unlock(:key)"), {'key': key})
+                except Exception as e:
+                    self.logger.error(f"Error releasing advisory lock {key}: {e}")
+                finally:
+                    conn.close()
+
+    def listen(self, channel, callback, stop_event, timeout=5):
+        # Calls callback with the payload of every notification on channel until stop_event is set
+        while not stop_event.is_set():
+            conn = None
+            try:
+                # Detach the connection from the pool, it is left in autocommit mode with LISTEN active
+                conn = self.engine.raw_connection()
+                conn.detach()
+                dbapi_conn = conn.dbapi_connection
+                dbapi_conn.autocommit = True
+                with dbapi_conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{channel}"')
+
+                while not stop_event.is_set():
+                    if select.select([dbapi_conn], [], [], timeout) == ([], [], []):
+                        continue
+                    dbapi_conn.poll()
+                    while dbapi_conn.notifies:
+                        notification = dbapi_conn.notifies.pop(0)
+                        callback(notification.payload)
+            except Exception as e:
+                self.logger.error(f"Error listening on channel {channel}: {e}")
+                stop_event.wait(timeout)
+            finally:
+                if conn:
+                    conn.close()
+
     def add_object(self, session, obj):
         try:
             session.add(obj)
@@ -89,6 +282,14 @@ class DatabaseClient:
         except Exception as e:
             self.logger.error(f"Error getting object from database: {e}")
 
+    def get_signatur_file_upload_status(self, session, id):
+        # Loads only what a status response needs
+        try:
+            upload = session.query(SignaturFileupload).options(load_only(SignaturFileupload.id, SignaturFileupload.status, SignaturFileupload.message)).filter(SignaturFileupload.id == id).first()
+            return upload
+        except Exception as e:
+            self.logger.error(f"Error getting object from database: {e}")
+
     def get_all_signatur_file_uploads(self, session):
         try:
             uploads = session.query(SignaturFileupload).all()
@@ -96,22 +297,116 @@ class DatabaseClient:
         except Exception as e:
             self.logger.error(f"Error getting object from database: {e}")
 
-    def get_stuck_signatur_file_uploads(self, session):
+    def fail_stuck_signatur_file_uploads(self, session, message):
+        # Sets uploads stuck in PROCESSING to FAILED in one UPDATE without loading them, returns the number of uploads updated
         try:
-            uploads = session.query(SignaturFileupload).filter(SignaturFileupload.status == STATUS_CODE.PROCESSING).filter(SignaturFileupload.updated_at < datetime.now() - timedelta(seconds=3600)).all()
-            return uploads
+            count = stuck_uploads_query(session).update({SignaturFileupload.status: STATUS_CODE.FAILED, SignaturFileupload.message: message}, synchronize_session=False)
+            session.commit()
+            return count
         except Exception as e:
-            self.logger.error(f"Error getting object from database: {e}")
+            session.rollback()
+            self.logger.error(f"Error updating objects in database: {e}")
 
-    def get_next_signatur_file_upload(self, session):
+    def purge_signatur_file_upload_files(self, session, older_than, batch_size):
+        # Removes the file content of up to batch_size SUCCESS or FAILED uploads not updated since older_than, keeping the rows.
+        # Returns the number of uploads purged and the bytes reclaimed.
         try:
-            upload = session.query(SignaturFileupload).filter(SignaturFileupload.status == STATUS_CODE.RECEIVED).order_by(SignaturFileupload.updated_at.asc()).with_for_update().first()
-            if upload:
+            uploads = session.query(SignaturFileupload.id, SignaturFileupload.file_oid, sqlalchemy.func.coalesce(SignaturFileupload.file_size, sqlalchemy.func.octet_length(SignaturFileupload.file_data), 0)).filter(SignaturFileupload.status.in_([STATUS_CODE.SUCCESS, STATUS_CODE.FAILED])).filter(SignaturFileupload.updated_at < older_than).filter(sqlalchemy.or_(SignaturFileupload.file_oid.isnot(None), SignaturFileupload.file_data.isnot(None))).limit(batch_size).with_for_update(skip_locked=True).all()
+            if not uploads:
+                session.commit()
+                return 0, 0
+            for _, file_oid, _ in uploads:
+                if file_oid is not None:
+                    session.execute(sqlalchemy.text("SELECT lo_unlink(oid) FROM pg_largeobject_metadata WHERE oid = :oid"), {'oid': file_oid})
+            # updated_at is kept, so the upload still shows when it was processed
+            session.query(SignaturFileupload).filter(SignaturFileupload.id.in_([upload[0] for upload in uploads])).update({SignaturFileupload.file_data: None, SignaturFileupload.file_oid: None, SignaturFileupload.updated_at: SignaturFileupload.updated_at}, synchronize_session=False)
+            session.commit()
+            return len(uploads), sum(upload[2] for upload in uploads)
+        except Exception as e:
+            session.rollback()
+            self.logger.error(f"Error purging files from database: {e}")
+            return 0, 0
+
+    def requeue_due_signatur_file_uploads(self, session):
+        # Moves FAILED_TRY_AGAIN uploads whose next attempt is due back to RECEIVED, returns the number of uploads requeued
+        try:
+            count = session.query(SignaturFileupload).filter(SignaturFileupload.status == STATUS_CODE.FAILED_TRY_AGAIN).filter(SignaturFileupload.next_attempt_at <= datetime.now()).update({SignaturFileupload.status: STATUS_CODE.RECEIVED, SignaturFileupload.next_attempt_at: None}, synchronize_session=False)
+            session.commit()
+            return count
+        except Exception as e:
+            session.rollback()
+            self.logger.error(f"Error updating objects in database: {e}")
+
+    def claim_signatur_file_upload_group(self, session, limit):
+        # Sets the oldest RECEIVED upload and up to limit - 1 other RECEIVED uploads for the same cpr, employment and institution
+        # to PROCESSING and returns them in queue order. Rows locked by others are skipped, and uploads for other employments
+        # are left for other workers.
+        try:
+            first = received_uploads_query(session).first()
+            if not first:
+                session.commit()
+                return []
+            uploads = [first] + received_uploads_query(session).filter(SignaturFileupload.id != first.id).filter(sqlalchemy.func.replace(SignaturFileupload.cpr, '-', '') == first.cpr.replace('-', '')).filter(SignaturFileupload.employment == first.employment).filter(SignaturFileupload.institutionIdentifier == first.institutionIdentifier).limit(limit - 1).all()
+            for upload in uploads:
                 upload.status = STATUS_CODE.PROCESSING
             session.commit()
-            return upload
+            return uploads
         except Exception as e:
-            self.logger.error(f"Error getting object from database: {e}")
+            session.rollback()
+            self.logger.error(f"Error getting objects from database: {e}")
+
+    def get_department_index_snapshot(self, session, region_identifier):
+        try:
+            # data is loaded when accessed, so checking the version doesn't read the whole index
+            snapshot = session.query(DepartmentIndexSnapshot).options(load_only(DepartmentIndexSnapshot.version, DepartmentIndexSnapshot.updated_at)).filter(DepartmentIndexSnapshot.region_identifier == region_identifier).first()
+            return snapshot
+        except Exception as e:
+            self.logger.error(f"Error getting department index snapshot from database: {e}")
+
+    def get_personalesag_mapping(self, session, cpr, employment, institution_identifier):
+        try:
+            mapping = session.query(PersonalesagMapping).filter(PersonalesagMapping.cpr == cpr, PersonalesagMapping.employment == employment, PersonalesagMapping.institution_identifier == institution_identifier).first()
+            return mapping
+        except Exception as e:
+            self.logger.error(f"Error getting personalesag mapping from database: {e}")
+
+    def save_personalesag_mapping(self, session, cpr, employment, institution_identifier, sag_id, delforloeb_id):
+        try:
+            values = {'cpr': cpr, 'employment': employment, 'institution_identifier': institution_identifier, 'sag_id': sag_id, 'delforloeb_id': delforloeb_id, 'updated_at': datetime.now()}
+            statement = insert(PersonalesagMapping).values(**values)
+            # Several workers may resolve the same employment at once - the last one wins
+            statement = statement.on_conflict_do_update(index_elements=['cpr', 'employment', 'institution_identifier'], set_={'sag_id': sag_id, 'delforloeb_id': delforloeb_id, 'updated_at': values['updated_at']})
+            session.execute(statement)
+            session.commit()
+            return True
+        except Exception as e:
+            session.rollback()
+            self.logger.error(f"Error saving personalesag mapping to database: {e}")
+
+    def delete_personalesag_mapping(self, session, cpr, employment, institution_identifier):
+        try:
+            session.query(PersonalesagMapping).filter(PersonalesagMapping.cpr == cpr, PersonalesagMapping.employment == employment, PersonalesagMapping.institution_identifier == institution_identifier).delete(synchronize_session=False)
+            session.commit()
+            return True
+        except Exception as e:
+            session.rollback()
+            self.logger.error(f"Error deleting personalesag mapping from database: {e}")
+
+    def save_department_index_snapshot(self, session, region_identifier, data):
+        try:
+            snapshot = session.query(DepartmentIndexSnapshot).filter(DepartmentIndexSnapshot.region_identifier == region_identifier).with_for_update().first()
+            if snapshot:
+                snapshot.version += 1
+                snapshot.data = data
+                snapshot.updated_at = datetime.now()
+            else:
+                snapshot = DepartmentIndexSnapshot(region_identifier=region_identifier, version=1, data=data, updated_at=datetime.now())
+                session.add(snapshot)
+            session.commit()
+            return snapshot
+        except Exception as e:
+            session.rollback()
+            self.logger.error(f"Error saving department index snapshot to database: {e}")
 
 
 class Base(DeclarativeBase):
@@ -120,23 +415,41 @@ class Base(DeclarativeBase):
 
 class SignaturFileupload(Base):
     __tablename__ = 'signatur_fileupload'
+    # Indexes are created on existing databases by migrations.py
+    __table_args__ = (
+        # Stuck uploads - status = PROCESSING AND updated_at < cutoff
+        Index('ix_signatur_fileupload_status_updated_at', 'status', 'updated_at'),
+        # The worker queue - status = RECEIVED ORDER BY updated_at, only covering the few rows waiting
+        Index('ix_signatur_fileupload_received_updated_at', 'updated_at', postgresql_where=sqlalchemy.text("status = 'RECEIVED'")),
+        # Retries due - status = FAILED_TRY_AGAIN AND next_attempt_at <= now
+        Index('ix_signatur_fileupload_retry_next_attempt_at', 'next_attempt_at', postgresql_where=sqlalchemy.text("status = 'FAILED_TRY_AGAIN'")),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     cpr = Column(String, nullable=False)
     institutionIdentifier = Column(String, nullable=False)
     employment = Column(String, nullable=False)
     message = Column(String, nullable=True)
     status = Column(Enum(STATUS_CODE), nullable=False, default=STATUS_CODE.RECEIVED)
-    file_data = Column(LargeBinary, nullable=False)
+    # Only set for uploads stored before files were moved to large objects - loaded when accessed
+    file_data = deferred(Column(LargeBinary, nullable=True))
+    file_oid = Column(BigInteger, nullable=True)
+    file_size = Column(BigInteger, nullable=True)
     file_name = Column(String, nullable=False)
     file_mimetype = Column(String, nullable=False)
     updated_at = Column(DateTime, onupdate=sqlalchemy.func.now())
+    attempt_count = Column(Integer, nullable=False, default=0, server_default='0')
+    next_attempt_at = Column(DateTime, nullable=True)
 
     @property
     def file(self):
-        return FileObject(self.file_data, self.file_name, self.file_mimetype)
+        # The stream reads the large object through the session this upload belongs to
+        if self.file_oid is not None:
+            stream = io.BufferedReader(LargeObjectReader(object_session(self), self.file_oid), LARGE_OBJECT_CHUNK_SIZE)
+            return FileObject(stream, self.file_name, self.file_mimetype, self.file_size)
+        return FileObject(io.BytesIO(self.file_data), self.file_name, self.file_mimetype, len(self.file_data))
 
     def __init__(self, file, institutionIdentifier: str, employment: str, cpr: str):
-        self.file_data = file.read()
+        # The file content is written by store_file once the upload is added to a session
         self.file_name = file.filename
         self.file_mimetype = file.mimetype
         self.institutionIdentifier = institutionIdentifier
@@ -149,19 +462,88 @@ class SignaturFileupload(Base):
 
     def get_id(self):
         return self.id
+
+    def has_file(self):
+        # False once the file has been removed by the retention job. For legacy uploads the database checks file_data,
+        # so the deferred blob isn't loaded.
+        if self.file_oid is not None:
+            return True
+        session = object_session(self)
+        if session is None or 'file_data' not in sqlalchemy.inspect(self).unloaded:
+            return self.file_data is not None
+        return session.query(SignaturFileupload.id).filter(SignaturFileupload.id == self.id).filter(SignaturFileupload.file_data.isnot(None)).first() is not None
     
+    def store_file(self, session, file):
+        # Copies the file into a new large object chunk by chunk, replacing the previous one in the same transaction
+        dbapi_conn = get_dbapi_connection(session)
+        if self.file_oid is not None:
+            dbapi_conn.lobject(self.file_oid).unlink()
+        lobject = dbapi_conn.lobject(0, 'wb')
+        try:
+            size = 0
+            chunk = file.stream.read(LARGE_OBJECT_CHUNK_SIZE)
+            while chunk:
+                size += lobject.write(chunk)
+                chunk = file.stream.read(LARGE_OBJECT_CHUNK_SIZE)
+        finally:
+            lobject.close()
+        self.file_oid = lobject.oid
+        self.file_size = size
+        self.file_data = None
+
     def update_values(self, file, institutionIdentifier, employment, cpr):
-        self.file_data = file.read()
         self.file_name = file.filename
         self.file_mimetype = file.mimetype
         self.institutionIdentifier = institutionIdentifier
         self.employment = employment
         self.cpr = cpr
+        self.reset_attempts()
         self.set_status(STATUS_CODE.RECEIVED, 'File upload updated')
     
     def set_status(self, status, message):
         self.status = status
         self.message = message
+
+    def reset_attempts(self):
+        self.attempt_count = 0
+        self.next_attempt_at = None
+
+    def schedule_retry(self, base_delay, max_delay, max_attempts):
+        # Called after a failed attempt - retries after an exponentially growing delay with jitter, or gives up after max_attempts
+        self.attempt_count = (self.attempt_count or 0) + 1
+        if self.attempt_count >= max_attempts:
+            self.next_attempt_at = None
+            self.set_status(STATUS_CODE.FAILED, f"{self.message} - gave up after {self.attempt_count} attempts")
+            return None
+        delay = min(base_delay * 2 ** (self.attempt_count - 1), max_delay)
+        # Jitter spreads out retries of uploads that failed together, e.g. during an SBSYS outage
+        self.next_attempt_at = datetime.now() + timedelta(seconds=random.uniform(delay / 2, delay))
+        return self.next_attempt_at
     
     def get_status(self):
-        return self.status, self.message
\ No newline at end of file
+        return self.status, self.message
+
+
+class DepartmentIndexSnapshot(Base):
+    __tablename__ = 'sd_department_index'
+    region_identifier = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False)
+    data = Column(JSONB, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<region:{self.region_identifier} version:{self.version} updated_at:{self.updated_at}>"
+
+
+# The sag and delforloeb files for an employment were last journalised to
+class PersonalesagMapping(Base):
+    __tablename__ = 'personalesag_mapping'
+    cpr = Column(String, primary_key=True)
+    employment = Column(String, primary_key=True)
+    institution_identifier = Column(String, primary_key=True)
+    sag_id = Column(BigInteger, nullable=False)
+    delforloeb_id = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<employment:{self.employment} institution:{self.institution_identifier} sag_id:{self.sag_id} delforloeb_id:{self.delforloeb_id}>"
@@ -0,0 +1,197 @@
+import logging
+import threading
+from datetime import datetime
+
+
+logger = logging.getLogger(__name__)
+
+# Postgres advisory lock held while building the index, so replicas don't build it at the same time
+DEPARTMENT_INDEX_LOCK_KEY = 4711002
+
+
+# Hash indexes over the SD departments grouped by level 3, built once per refresh
+class Level3DepartmentLookup:
+    def __init__(self, departments_by_level_3):
+        self.departments_by_level_3 = departments_by_level_3
+        # level 3 code -> set of department codes below it
+        self.codes_by_key = {}
+        # department name -> set of level 3 codes it is found below
+        self.keys_by_name = {}
+        for key, value in departments_by_level_3.items():
+            self.codes_by_key[key] = set(value.get('codes', []))
+            for name in value.get('names', []):
+                self.keys_by_name.setdefault(name, set()).add(key)
+
+    def __len__(self):
+        return len(self.departments_by_level_3)
+
+    def match(self, department_name, department_code):
+        # True if department_name and department_code are found below the same level 3 department
+        for key in self.keys_by_name.get(department_name, ()):
+            if department_code in self.codes_by_key[key]:
+                return True
+        return False
+
+
+# Matches SBSYS Ansaettelsessted names against the SD department names of an institution snapshot
+class DepartmentNameIndex:
+    NGRAM_LENGTH = 3
+    # SD truncates department names to 30 characters
+    TRUNCATED_LENGTH = 30
+
+    def __init__(self, inst_list):
+        # department name -> set of DepartmentIdentifiers with that name
+        self.codes_by_name = {}
+        # ngram -> set of department names containing it
+        self.names_by_ngram = {}
+        # Ansaettelsessted name -> set of matching DepartmentIdentifiers
+        self.matches = {}
+
+        stack = [institution.get('Department', {}) for institution in inst_list]
+        while stack:
+            department = stack.pop()
+            if isinstance(department, list):
+                stack.extend(department)
+            elif isinstance(department, dict):
+                department_name = department.get('DepartmentName', '')
+                if isinstance(department_name, str):
+                    self.codes_by_name.setdefault(department_name, set()).add(department.get('DepartmentIdentifier'))
+                if department.get('Department', None) is not None:
+                    stack.append(department['Department'])
+
+        for name in self.codes_by_name:
+            for ngram in self.ngrams(name):
+                self.names_by_ngram.setdefault(ngram, set()).add(name)
+
+    def ngrams(self, text):
+        return {text[i:i + self.NGRAM_LENGTH] for i in range(len(text) - self.NGRAM_LENGTH + 1)}
+
+    def names_containing(self, location):
+        if len(location) < self.NGRAM_LENGTH:
+            return [name for name in self.codes_by_name if location in name]
+        # Only names sharing every ngram of location can contain it - start from the rarest ngram
+        postings = sorted((self.names_by_ngram.get(ngram, set()) for ngram in self.ngrams(location)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates &= posting
+        return [name for name in candidates if location in name]
+
+    def find(self, location):
+        if location in self.matches:
+            return self.matches[location]
+
+        codes = set(self.codes_by_name.get(location, ()))
+        # Department names containing the location
+        for name in self.names_containing(location):
+            codes |= self.codes_by_name[name]
+        # Department names truncated to 30 characters
+        truncated = location[:self.TRUNCATED_LENGTH]
+        if len(truncated) == self.TRUNCATED_LENGTH:
+            codes |= self.codes_by_name.get(truncated, set())
+
+        self.matches[location] = codes
+        return codes
+
+
+department_name_indexes = {}
+department_name_indexes_lock = threading.Lock()
+
+
+def get_department_name_index(inst_identifier, inst_list):
+    # Reuse the index as long as inst_list is the same institution snapshot it was built from
+    with department_name_indexes_lock:
+        cached = department_name_indexes.get(inst_identifier, None)
+        if cached and cached[0] is inst_list:
+            return cached[1]
+    department_name_index = DepartmentNameIndex(inst_list)
+    with department_name_indexes_lock:
+        department_name_indexes[inst_identifier] = (inst_list, department_name_index)
+    return department_name_index
+
+
+# Holds the SD departments grouped by level 3, shared by all workers and persisted in the database
+class DepartmentIndexCache:
+    def __init__(self, db_client, region_identifier, builder, refresh_interval, check_interval):
+        self.db_client = db_client
+        self.region_identifier = region_identifier
+        self.builder = builder
+        self.refresh_interval = refresh_interval
+        self.check_interval = check_interval
+        self.ready = threading.Event()
+        self.refresh_lock = threading.Lock()
+        # (version, updated_at, Level3DepartmentLookup) - replaced as a whole, so readers never see a partial index
+        self.snapshot = None
+
+    def get(self):
+        snapshot = self.snapshot
+        if snapshot:
+            return snapshot[2]
+        return None
+
+    def status(self):
+        snapshot = self.snapshot
+        if not snapshot:
+            return {'ready': False, 'version': None, 'updated_at': None, 'age_seconds': None}
+        return {'ready': True, 'version': snapshot[0], 'updated_at': snapshot[1].isoformat(),
+                'age_seconds': round((datetime.now() - snapshot[1]).total_seconds())}
+
+    def is_stale(self, updated_at):
+        return (datetime.now() - updated_at).total_seconds() > self.refresh_interval
+
+    def swap(self, version, updated_at, data):
+        self.snapshot = (version, updated_at, Level3DepartmentLookup(data))
+        self.ready.set()
+        logger.info(f"SD level 3 - using department index version {version} from {updated_at}")
+
+    def load_snapshot(self):
+        with self.db_client.get_session() as session:
+            snapshot = self.db_client.get_department_index_snapshot(session, self.region_identifier)
+            if not snapshot:
+                return None
+            current = self.snapshot
+            # Only a new version loads the data
+            if not current or current[0] != snapshot.version or current[1] != snapshot.updated_at:
+                self.swap(snapshot.version, snapshot.updated_at, snapshot.data)
+            return snapshot.updated_at
+
+    def refresh(self):
+        with self.refresh_lock:
+            updated_at = self.load_snapshot()
+            if updated_at and not self.is_stale(updated_at):
+                return True
+
+            # Only one replica builds the index - the others keep their snapshot and load the new one on a later check
+            with self.db_client.try_advisory_lock(DEPARTMENT_INDEX_LOCK_KEY) as acquired:
+                if not acquired:
+                    logger.info("SD level 3 - another replica is building the department index")
+                    return self.snapshot is not None
+                # Another replica may have refreshed the snapshot before we got the lock
+                updated_at = self.load_snapshot()
+                if updated_at and not self.is_stale(updated_at):
+                    return True
+                return self.build()
+
+    def build(self):
+        logger.info(f"SD level 3 - building department index for region {self.region_identifier}")
+        data = self.builder(self.region_identifier)
+        if not data:
+            logger.error("SD level 3 - unable to build department index, keeping the current one")
+            return False
+
+        with self.db_client.get_session() as session:
+            snapshot = self.db_client.save_department_index_snapshot(session, self.region_identifier, data)
+            if snapshot:
+                self.swap(snapshot.version, snapshot.updated_at, data)
+            else:
+                self.swap(self.snapshot[0] if self.snapshot else 0, datetime.now(), data)
+        return True
+
+    def refresh_job(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"SD level 3 - error while refreshing department index: {e}")
+            stop_event.wait(self.check_interval)
@@ -0,0 +1,52 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from config import HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+
+
+sessions = {}
+sessions_lock = threading.Lock()
+
+
+# requests.Session with a sized keep-alive connection pool and default timeouts
+class PooledSession(requests.Session):
+    def __init__(self, pool_connections, pool_maxsize, timeout):
+        super().__init__()
+        self.timeout = timeout
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.mount('https://', self.adapter)
+        self.mount('http://', self.adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout', None) is None:
+            kwargs['timeout'] = self.timeout
+        return super().request(method, url, **kwargs)
+
+    def pool_metrics(self):
+        metrics = {}
+        pools = self.adapter.poolmanager.pools
+        for pool_key in pools.keys():
+            pool = pools.get(pool_key, None)
+            if not pool:
+                continue
+            # The pool queue is filled with None placeholders for connections not yet created
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+            metrics[f"{pool_key.key_scheme}://{pool_key.key_host}:{pool_key.key_port}"] = {
+                'connections_created': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle': idle,
+                'maxsize': pool.pool.maxsize if pool.pool else 0
+            }
+        return metrics
+
+
+def create_session(name, pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT):
+    session = PooledSession(pool_connections, pool_maxsize, (connect_timeout, read_timeout))
+    with sessions_lock:
+        sessions[name] = session
+    return session
+
+
+def pool_metrics():
+    with sessions_lock:
+        return {name: session.pool_metrics() for name, session in sessions.items()}
@@ -0,0 +1,77 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+
+class LimiterTimeout(Exception):
+    pass
+
+
+# Limits the number of concurrent calls. Waiting callers are let through by priority (lowest first),
+# then in arrival order, and give up after queue_timeout seconds.
+class PriorityLimiter:
+    def __init__(self, max_concurrency, queue_timeout):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.active = 0
+        self.calls = 0
+        self.timeouts = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.execution_total = 0.0
+        self.execution_max = 0.0
+
+    @contextmanager
+    def slot(self, priority=0):
+        ticket = (priority, next(self.sequence))
+        queued_at = time.monotonic()
+        deadline = queued_at + self.queue_timeout
+        with self.condition:
+            heapq.heappush(self.waiting, ticket)
+            while self.active >= self.max_concurrency or self.waiting[0] != ticket:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.waiting.remove(ticket)
+                    heapq.heapify(self.waiting)
+                    self.timeouts += 1
+                    # The next caller in line may be able to go now
+                    self.condition.notify_all()
+                    raise LimiterTimeout(f"No free slot within {self.queue_timeout} seconds")
+                self.condition.wait(remaining)
+            heapq.heappop(self.waiting)
+            self.active += 1
+            queue_wait = time.monotonic() - queued_at
+            self.calls += 1
+            self.queue_wait_total += queue_wait
+            self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+            self.condition.notify_all()
+
+        started_at = time.monotonic()
+        try:
+            yield queue_wait
+        finally:
+            execution = time.monotonic() - started_at
+            with self.condition:
+                self.active -= 1
+                self.execution_total += execution
+                self.execution_max = max(self.execution_max, execution)
+                self.condition.notify_all()
+
+    def metrics(self):
+        with self.condition:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'active': self.active,
+                'queued': len(self.waiting),
+                'calls': self.calls,
+                'timeouts': self.timeouts,
+                'queue_wait_avg': self.queue_wait_total / self.calls if self.calls else 0.0,
+                'queue_wait_max': self.queue_wait_max,
+                'execution_avg': self.execution_total / self.calls if self.calls else 0.0,
+                'execution_max': self.execution_max
+            }
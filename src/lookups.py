@@ -0,0 +1,34 @@
+import time
+import logging
+from concurrent.futures import wait, FIRST_COMPLETED
+
+
+logger = logging.getLogger(__name__)
+
+
+def run_lookups(executor, lookups: dict, required: list, timeout: float):
+    # Runs the independent lookups concurrently on executor and returns their results by name - a lookup that failed or timed out
+    # is left out, so it can be told apart from a lookup that found nothing. Stops as soon as a required lookup fails,
+    # cancelling the lookups not started yet.
+    futures = {executor.submit(lookup): name for name, lookup in lookups.items()}
+    results = {}
+    pending = set(futures)
+    deadline = time.monotonic() + timeout
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                logger.error(f"Lookups timed out after {timeout} seconds: {', '.join(futures[future] for future in pending)}")
+                break
+            for future in done:
+                name = futures[future]
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    logger.error(f"Lookup {name} failed: {e}")
+                if name in required and not results.get(name):
+                    return results
+    finally:
+        for future in pending:
+            future.cancel()
+    return results
@@ -0,0 +1,178 @@
+import time
+import logging
+import sqlalchemy
+
+from database import DepartmentIndexSnapshot, PersonalesagMapping
+
+
+logger = logging.getLogger(__name__)
+
+# Postgres advisory lock held while migrating, so only one process migrates at a time
+MIGRATION_LOCK_KEY = 4711001
+MIGRATION_LOCK_POLL_SECONDS = 2
+BACKFILL_BATCH_SIZE = 500
+
+
+class SchemaVersionError(Exception):
+    pass
+
+
+# A schema change applied once and recorded in schema_version.
+# Non-transactional migrations run in autocommit mode, needed for CREATE INDEX CONCURRENTLY and batched backfills,
+# so they must be safe to run again if interrupted.
+class Migration:
+    def __init__(self, version, description, upgrade, transactional=True):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+        self.transactional = transactional
+
+    def __repr__(self):
+        return f"<migration:{self.version} {self.description}>"
+
+
+def execute_all(*statements):
+    def upgrade(conn):
+        for statement in statements:
+            conn.execute(sqlalchemy.text(statement))
+    return upgrade
+
+
+def create_index_concurrently(name, definition):
+    # Builds the index without blocking writes. A failed concurrent build leaves an invalid index behind, which is dropped first.
+    def upgrade(conn):
+        invalid = conn.execute(sqlalchemy.text("SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :name AND NOT i.indisvalid"), {'name': name}).first()
+        if invalid:
+            logger.info(f"Dropping invalid index {name}")
+            conn.execute(sqlalchemy.text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        conn.execute(sqlalchemy.text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}"))
+    return upgrade
+
+
+def backfill_in_batches(statement):
+    # statement updates at most :batch_size rows - each batch is committed on its own, so locks are held briefly
+    def upgrade(conn):
+        total = 0
+        while True:
+            count = conn.execute(sqlalchemy.text(statement), {'batch_size': BACKFILL_BATCH_SIZE}).rowcount
+            total += count
+            if count < BACKFILL_BATCH_SIZE:
+                break
+        logger.info(f"Backfilled {total} rows")
+    return upgrade
+
+
+MIGRATIONS = [
+    # The schema before migrations were introduced - pinned, so later migrations always start from the same tables.
+    # Databases created before migrations already have it.
+    Migration(1, "Create tables", execute_all(
+        """DO $$ BEGIN
+            CREATE TYPE status_code AS ENUM ('FAILED', 'FAILED_TRY_AGAIN', 'RECEIVED', 'PROCESSING', 'SUCCESS');
+        EXCEPTION WHEN duplicate_object THEN NULL;
+        END $$""",
+        'CREATE TABLE IF NOT EXISTS signatur_fileupload ('
+        'id UUID NOT NULL PRIMARY KEY, '
+        'cpr VARCHAR NOT NULL, '
+        '"institutionIdentifier" VARCHAR NOT NULL, '
+        'employment VARCHAR NOT NULL, '
+        'message VARCHAR, '
+        'status status_code NOT NULL, '
+        'file_data BYTEA NOT NULL, '
+        'file_name VARCHAR NOT NULL, '
+        'file_mimetype VARCHAR NOT NULL, '
+        'updated_at TIMESTAMP WITHOUT TIME ZONE)'
+    )),
+    Migration(2, "Store uploaded files as large objects", execute_all(
+        'ALTER TABLE signatur_fileupload ADD COLUMN IF NOT EXISTS file_oid BIGINT',
+        'ALTER TABLE signatur_fileupload ADD COLUMN IF NOT EXISTS file_size BIGINT',
+        'ALTER TABLE signatur_fileupload ALTER COLUMN file_data DROP NOT NULL'
+    )),
+    Migration(3, "Index stuck uploads", create_index_concurrently(
+        'ix_signatur_fileupload_status_updated_at', 'ON signatur_fileupload (status, updated_at)'
+    ), transactional=False),
+    Migration(4, "Index the upload queue", create_index_concurrently(
+        'ix_signatur_fileupload_received_updated_at', "ON signatur_fileupload (updated_at) WHERE status = 'RECEIVED'"
+    ), transactional=False),
+    Migration(5, "Backfill file_size of uploads stored in file_data", backfill_in_batches(
+        'UPDATE signatur_fileupload SET file_size = length(file_data) WHERE id IN '
+        '(SELECT id FROM signatur_fileupload WHERE file_size IS NULL AND file_data IS NOT NULL LIMIT :batch_size)'
+    ), transactional=False),
+    Migration(6, "Track upload attempts", execute_all(
+        'ALTER TABLE signatur_fileupload ADD COLUMN IF NOT EXISTS attempt_count INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE signatur_fileupload ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP'
+    )),
+    Migration(7, "Index retries due", create_index_concurrently(
+        'ix_signatur_fileupload_retry_next_attempt_at', "ON signatur_fileupload (next_attempt_at) WHERE status = 'FAILED_TRY_AGAIN'"
+    ), transactional=False),
+    Migration(8, "Create personalesag mapping", lambda conn: PersonalesagMapping.__table__.create(conn, checkfirst=True)),
+    # Databases migrated while version 1 created the tables of all models already have it
+    Migration(9, "Create department index snapshots", lambda conn: DepartmentIndexSnapshot.__table__.create(conn, checkfirst=True)),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def get_schema_version(conn):
+    return conn.execute(sqlalchemy.text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def record_version(conn, migration):
+    conn.execute(sqlalchemy.text("INSERT INTO schema_version (version, description, applied_at) VALUES (:version, :description, now())"),
+                 {'version': migration.version, 'description': migration.description})
+
+
+def acquire_migration_lock(conn):
+    # Polls instead of blocking in pg_advisory_lock - a waiting transaction would hold up CREATE INDEX CONCURRENTLY in the process migrating
+    while not conn.execute(sqlalchemy.text("SELECT pg_try_advisory_lock(:key)"), {'key': MIGRATION_LOCK_KEY}).scalar():
+        logger.info("Waiting for another process to finish migrating")
+        time.sleep(MIGRATION_LOCK_POLL_SECONDS)
+
+
+def upgrade(engine):
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        # Locked first - replicas creating schema_version at the same time can collide on the pg_type unique index
+        acquire_migration_lock(conn)
+        # Index builds and backfills may run longer than DB_STATEMENT_TIMEOUT_MS
+        conn.execute(sqlalchemy.text("SET statement_timeout = 0"))
+        try:
+            conn.execute(sqlalchemy.text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, description VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL)"))
+            version = get_schema_version(conn)
+            for migration in MIGRATIONS:
+                if migration.version <= version:
+                    continue
+                logger.info(f"Applying migration {migration.version}: {migration.description}")
+                start = time.monotonic()
+                if migration.transactional:
+                    with engine.begin() as transaction:
+                        transaction.execute(sqlalchemy.text("SET LOCAL statement_timeout = 0"))
+                        migration.upgrade(transaction)
+                        record_version(transaction, migration)
+                else:
+                    migration.upgrade(conn)
+                    record_version(conn, migration)
+                logger.info(f"Applied migration {migration.version} in {time.monotonic() - start:.1f} seconds")
+            logger.info(f"Database schema is at version {LATEST_VERSION}")
+        finally:
+            conn.execute(sqlalchemy.text("SELECT pg_advisory_unlock(:key)"), {'key': MIGRATION_LOCK_KEY})
+            conn.execute(sqlalchemy.text("RESET statement_timeout"))
+
+
+def check(engine):
+    # Only reads the schema version - the schema is expected to be migrated by a separate upgrade run
+    try:
+        with engine.connect() as conn:
+            version = get_schema_version(conn)
+    except sqlalchemy.exc.ProgrammingError:
+        version = 0
+    if version < LATEST_VERSION:
+        raise SchemaVersionError(f"Database schema is at version {version}, expected {LATEST_VERSION} - run with DB_MIGRATION_MODE=upgrade")
+    logger.info(f"Database schema is at version {version}")
+
+
+def run_migrations(db_client, mode):
+    if mode == 'upgrade':
+        upgrade(db_client.get_engine())
+    elif mode == 'check':
+        check(db_client.get_engine())
+    elif mode != 'off':
+        raise ValueError(f"Invalid DB_MIGRATION_MODE {mode}, must be upgrade, check or off")
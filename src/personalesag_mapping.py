@@ -0,0 +1,47 @@
+import logging
+from cache import LRUCache
+
+
+logger = logging.getLogger(__name__)
+
+
+# Remembers the sag and delforloeb an employment was journalised to, in memory and in the database,
+# so later uploads for the same employment skip matching SD and SBSYS
+class PersonalesagMappingCache:
+    def __init__(self, db_client, maxsize):
+        self.db_client = db_client
+        # (cpr, employment, institution) -> (sag_id, delforloeb_id)
+        self.mappings = LRUCache(maxsize)
+
+    @staticmethod
+    def key(cpr, employment, institution_identifier):
+        return cpr.replace('-', ''), employment, institution_identifier
+
+    def get(self, cpr, employment, institution_identifier):
+        key = self.key(cpr, employment, institution_identifier)
+        mapping = self.mappings.get(key)
+        if mapping:
+            return mapping
+        with self.db_client.get_session() as session:
+            stored = self.db_client.get_personalesag_mapping(session, *key)
+            if not stored:
+                return None
+            mapping = (stored.sag_id, stored.delforloeb_id)
+        self.mappings.set(key, mapping)
+        return mapping
+
+    def save(self, cpr, employment, institution_identifier, sag_id, delforloeb_id):
+        key = self.key(cpr, employment, institution_identifier)
+        self.mappings.set(key, (sag_id, delforloeb_id))
+        with self.db_client.get_session() as session:
+            self.db_client.save_personalesag_mapping(session, *key, sag_id, delforloeb_id)
+
+    def invalidate(self, cpr, employment, institution_identifier):
+        key = self.key(cpr, employment, institution_identifier)
+        logger.info(f"Invalidating personalesag mapping for employment {employment} in institution {institution_identifier}")
+        self.mappings.invalidate(key)
+        with self.db_client.get_session() as session:
+            self.db_client.delete_personalesag_mapping(session, *key)
+
+    def stats(self):
+        return self.mappings.stats()
@@ -1,4 +1,5 @@
 from utils import SBSYSClient
+from cache import TTLCache
 import json
 import logging
 
@@ -6,9 +7,18 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class SBSYSError(Exception):
+    pass
+
+
 class SBSYSOperations:
-    def __init__(self):
+    def __init__(self, personalesager_cache_ttl=120):
         self.client = SBSYSClient()
+        # Active personalesager by cpr without dash - several uploads for the same person often arrive together
+        self.personalesager_cache = TTLCache(personalesager_cache_ttl)
+
+    def cache_stats(self):
+        return self.personalesager_cache.stats()
 
     def find_newest_personalesag(self, data):
         try:
@@ -66,47 +76,50 @@ class SBSYSOperations:
             return None
 
     def fetch_active_personalesager(self, cpr):
-        try:
-            if len(cpr) == 10:
-                cpr = cpr[:6] + '-' + cpr[6:]  # Reformat the CPR
-
-            # sag_search payload
-            payload = {
-                "PrimaerPerson": {
-                    "CprNummer": cpr
-                }
+        # Empty results are not cached, so a person without a personalesag is looked up again. Raises SBSYSError if the search failed.
+        return self.personalesager_cache.get_or_load(cpr.replace('-', ''), lambda: self._fetch_active_personalesager(cpr))
+
+    def invalidate_active_personalesager(self, cpr):
+        # Must be called when a personalesag may have been created for cpr
+        self.personalesager_cache.invalidate(cpr.replace('-', ''))
+
+    def _fetch_active_personalesager(self, cpr):
+        # Returns the active personalesager of cpr - empty if there are none. Raises SBSYSError if the search failed,
+        # so a failed search is not taken for a person without a personalesag.
+        if len(cpr) == 10:
+            cpr = cpr[:6] + '-' + cpr[6:]  # Reformat the CPR
+
+        # sag_search payload
+        payload = {
+            "PrimaerPerson": {
+                "CprNummer": cpr
             }
-            response = self.client.search_cases(payload)
+        }
+        response = self.client.search_cases(payload)
 
-            if not response:
-                logger.info(f"sag_search response is None - No sager found for cpr: {cpr}")
-                return None
-
-            # Fetch the sag objects from 'Results' in response
-            sager = response.get('Results', None)
-            if not sager:
-                logger.info(f"Results in sag_search is empty - No sager found for cpr: {cpr}")
-                return None
+        if not response:
+            raise SBSYSError(f"sag_search failed for cpr: {cpr}")
 
-            # Filter active sager by checking if SagsStatus.Navn is 'Aktiv'
-            active_sager = [sag for sag in sager if sag.get('SagsStatus', {}).get('Navn') == 'Aktiv']
+        # Fetch the sag objects from 'Results' in response
+        sager = response.get('Results', None)
+        if not sager:
+            logger.info(f"Results in sag_search is empty - No sager found for cpr: {cpr}")
+            return []
 
-            if not active_sager:
-                logger.info(f"No active sager found for cpr: {cpr}")
-                return None
+        # Filter active sager by checking if SagsStatus.Navn is 'Aktiv'
+        active_sager = [sag for sag in sager if sag.get('SagsStatus', {}).get('Navn') == 'Aktiv']
 
-            # Filter personalesager based on KLE and FACET numbers starting with "81.03.00-G01"
-            active_personalesager = [sag for sag in active_sager if sag.get('Nummer', '').startswith('81.03.00-G01')]
+        if not active_sager:
+            logger.info(f"No active sager found for cpr: {cpr}")
+            return []
 
-            if not active_personalesager:
-                logger.info(f"No active personalesager found for cpr: {cpr}")
-                return None
+        # Filter personalesager based on KLE and FACET numbers starting with "81.03.00-G01"
+        active_personalesager = [sag for sag in active_sager if sag.get('Nummer', '').startswith('81.03.00-G01')]
 
-            return active_personalesager
+        if not active_personalesager:
+            logger.info(f"No active personalesager found for cpr: {cpr}")
 
-        except Exception as e:
-            logger.error(f"Error while fetching active personalesager: {e}")
-            return None
+        return active_personalesager
 
     def fetch_delforloeb_files(self, sag_id: int, delforloeb_title: str, allowed_filetypes: list, document_keywords: list):
         try:
@@ -156,8 +169,8 @@ class SBSYSOperations:
                 # DokumentArt Id 1 = "Indgående" dokument art
             }
 
-            # Prepare the files parameter as a dictionary
-            files = {'file': (file.filename, file.stream, file.mimetype)}
+            # Prepare the files parameter as a dictionary - the file is streamed from the database
+            files = {'file': (file.filename, file.stream, file.mimetype, file.size)}
 
             # Call the journalise_file_personalesag method and capture the response
             response = self.client.journalise_file_personalesag(json_data, files, delforloeb_id)
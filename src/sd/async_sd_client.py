@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import httpx
+from datetime import datetime
+from typing import Dict, Optional
+from async_api_client import AsyncBaseAPIClient
+from cache import TTLCache
+from sd.sd_client import EMPLOYMENT_PATH, INSTITUTION_PATH, DEPARTMENT_PATH, parse_sd_response, employment_params, \
+    parse_employment, parse_institution_list, department_params, parse_department_list
+
+
+logger = logging.getLogger(__name__)
+
+
+# Async counterpart of SDAPIClient
+class AsyncSDAPIClient(AsyncBaseAPIClient):
+    def __init__(self, username, password, url):
+        super().__init__(url)
+        self.auth = httpx.BasicAuth(username, password)
+
+    def get_headers(self):
+        return {"Content-Type": "application/xml"}
+
+    async def _make_request(self, method, path, **kwargs):
+        response = await super()._make_request(method, path, auth=self.auth, **kwargs)
+
+        # Ensure we have a proper response object
+        if not isinstance(response, httpx.Response):
+            logger.error(f"Expected a Response object, but got {type(response)}. Path: {path}")
+            return None
+
+        return parse_sd_response(response.content, response.headers.get('Content-Type', ''))
+
+
+# Async counterpart of SDClient with the same method surface
+class AsyncSDClient:
+    def __init__(self, username, password, url, cache_ttl=3600):
+        self.api_client = AsyncSDAPIClient(username, password, url)
+        # Departments keyed by institution/region and activation date
+        self.departments_cache = TTLCache(cache_ttl)
+        # key -> task loading it, awaited by every coroutine asking for the key meanwhile
+        self.loading = {}
+
+    def cache_stats(self):
+        return self.departments_cache.stats()
+
+    async def get_request(self, path: str, params: Optional[Dict[str, str]] = None):
+        try:
+            return await self.api_client.get(path, params=params)
+        except Exception as e:
+            logger.error(f"An error occurred while perform get_request: {e}")
+
+    async def post_request(self, path: str, params: Optional[Dict[str, str]] = None):
+        try:
+            return await self.api_client.post(path, params=params)
+        except Exception as e:
+            logger.error(f"An error occurred while perform post_request: {e}")
+
+    async def GetEmployment20111201(self, cpr, employment_identifier, inst_code, effective_date=None):
+        try:
+            response = await self.get_request(path=EMPLOYMENT_PATH, params=employment_params(cpr, employment_identifier, inst_code, effective_date))
+            return parse_employment(response, cpr)
+        except Exception as e:
+            logger.error(f"An error occured GetEmployment20111201: {e}")
+
+    async def cached(self, key, loader):
+        # TTLCache.get_or_load blocks while another thread loads, so coroutines check and fill the cache themselves.
+        # Concurrent loads of the same key share one task.
+        value = self.departments_cache.get(key)
+        if value is not None:
+            return value
+        task = self.loading.get(key)
+        if task is None:
+            self.departments_cache.record_miss()
+            task = asyncio.ensure_future(self.load(key, loader))
+            self.loading[key] = task
+        else:
+            self.departments_cache.record_coalesced()
+        # A cancelled caller must not cancel the load the others are waiting for
+        return await asyncio.shield(task)
+
+    async def load(self, key, loader):
+        try:
+            value = await loader()
+            # Empty results are not cached, so a failed load is retried by the next caller
+            if value:
+                self.departments_cache.set(key, value)
+            return value
+        finally:
+            self.loading.pop(key, None)
+
+    async def fetch_institutions_and_departments(self, region_identifier):
+        date_today = datetime.now().strftime('%d.%m.%Y')
+        return await self.cached(('region', region_identifier, date_today),
+                                 lambda: self._fetch_institutions_and_departments(region_identifier, date_today))
+
+    async def _fetch_institutions_and_departments(self, region_identifier, date_today):
+        try:
+            logger.info("Fetching SD institutions...")
+            response = await self.post_request(path=INSTITUTION_PATH, params={'RegionIdentifier': region_identifier})
+            inst_list = parse_institution_list(response)
+            if not inst_list:
+                return None
+            logger.info("Fetching SD institutions success")
+
+            institutions = []
+            for inst in inst_list:
+                institution_identifier = inst.get('InstitutionIdentifier', None)
+                institution_name = inst.get('InstitutionName', None)
+                if not institution_identifier or not institution_name:
+                    logger.warning("InstitutionIdentifier or InstitutionName is None")
+                    continue
+                institutions.append((institution_identifier, institution_name))
+
+            # The departments of all institutions are fetched at the same time
+            logger.info("Fetching SD departments...")
+            responses = await asyncio.gather(*(self.post_request(path=DEPARTMENT_PATH, params=department_params(institution_identifier, date_today))
+                                               for institution_identifier, _ in institutions))
+            inst_and_dep = []
+            for (institution_identifier, institution_name), response in zip(institutions, responses):
+                department_list = parse_department_list(response)
+                if not department_list:
+                    return None
+                inst_and_dep.append({'InstitutionIdentifier': institution_identifier,
+                                     'InstitutionName': institution_name,
+                                     'Department': department_list})
+            logger.info("Fetching SD departments success")
+            return inst_and_dep
+
+        except Exception as e:
+            logger.error(f"Error while fetching inst and departments: {e} \n"
+                         f"Region code: {region_identifier}")
+            return []
+
+    async def fetch_departments(self, inst_identifier):
+        if not inst_identifier:
+            logger.warning("InstitutionIdentifier is None")
+            return
+        date_today = datetime.now().strftime('%d.%m.%Y')
+        return await self.cached(('institution', inst_identifier, date_today),
+                                 lambda: self._fetch_departments(inst_identifier, date_today))
+
+    async def _fetch_departments(self, inst_identifier, date_today):
+        try:
+            logger.info("Fetching SD departments...")
+            response = await self.post_request(path=DEPARTMENT_PATH, params=department_params(inst_identifier, date_today))
+            department_list = parse_department_list(response)
+            if not department_list:
+                return None
+            logger.info("Fetching SD departments success")
+            return [{'InstitutionIdentifier': inst_identifier, 'Department': department_list}]
+
+        except Exception as e:
+            logger.error(f"Error while fetching inst and departments: {e} \n"
+                         f"Institution identifier: {inst_identifier}")
+            return []
+
+    async def aclose(self):
+        await self.api_client.aclose()
@@ -7,6 +7,7 @@ from datetime import datetime
 from requests.auth import HTTPBasicAuth
 from typing import Dict, Tuple, Optional
 from base_api_client import BaseAPIClient
+from cache import TTLCache
 
 
 logger = logging.getLogger(__name__)
@@ -17,7 +18,7 @@ class SDAPIClient(BaseAPIClient):
     _client_cache: Dict[Tuple[str, str], 'SDAPIClient'] = {}
 
     def __init__(self, username, password, url):
-        super().__init__(url)
+        super().__init__(url, session_name='sd')
         self.username = username
         self.password = password
 
@@ -52,32 +53,7 @@ class SDAPIClient(BaseAPIClient):
 
             # Get the content type of the response
             content_type = kwargs.get('headers', {}).get('Content-Type', response.headers.get('Content-Type', ''))
-
-            # Check if the response is HTML or XML
-            if 'text/html' in content_type:
-                return None
-            elif 'application/xml' in content_type or 'text/xml' in content_type:
-                # Handle XML response
-                try:
-                    response_dict = xml_to_json(response.content)
-                    # Check for SOAP Fault in the response
-                    fault = response_dict.get('Envelope', {}).get('Body', {}).get('Fault', None)
-                    if fault:
-                        fault_code = fault.get('faultcode', 'No fault code')
-                        fault_string = fault.get('faultstring', 'No fault string')
-                        fault_actor = fault.get('faultactor', 'No fault actor')
-                        fault_detail = fault.get('detail', {}).get('string', 'No fault detail')
-                        logger.error(
-                            f"SOAP Fault occurred: Code: {fault_code}, String: {fault_string}, Actor: {fault_actor}, Detail: {fault_detail}")
-                        return None
-
-                    return response_dict
-                except Exception as e:
-                    logger.error(f"An error occurred while parsing the XML response: {e}")
-                    return None
-            else:
-                logger.warning("Received a response that is neither HTML nor XML.")
-                return None
+            return parse_sd_response(response.content, content_type)
 
         except requests.RequestException as e:
             logger.error(f"An error occurred while making the request: {e}")
@@ -85,9 +61,14 @@ class SDAPIClient(BaseAPIClient):
 
 
 class SDClient:
-    def __init__(self, username, password, url):
+    def __init__(self, username, password, url, cache_ttl=3600):
         self.api_client = SDAPIClient.get_client(username, password, url)
         self.auth = self.api_client.authenticate()
+        # Departments keyed by institution/region and activation date
+        self.departments_cache = TTLCache(cache_ttl)
+
+    def cache_stats(self):
+        return self.departments_cache.stats()
 
     def get_request(self, path: str, params: Optional[Dict[str, str]] = None):
         try:
@@ -118,94 +99,27 @@ class SDClient:
             logger.error(f"An error occurred while perform delete_request: {e}")
 
     def GetEmployment20111201(self, cpr, employment_identifier, inst_code, effective_date=None):
-        path = 'GetEmployment20111201'
-
-        # Strip "-" from cpr
-        cpr = cpr.replace("-", "")
-
-        if not effective_date:
-            # Get the current date and format it as DD.MM.YYYY
-            effective_date = "01.01.5000"
-
-        # Define the SD params
-        params = {
-            'InstitutionIdentifier': inst_code,
-            'EmploymentStatusIndicator': 'true',
-            'PersonCivilRegistrationIdentifier': cpr,
-            'EmploymentIdentifier': employment_identifier,
-            'DepartmentIdentifier': '',
-            'ProfessionIndicator': 'false',
-            'DepartmentIndicator': 'true',
-            'WorkingTimeIndicator': 'false',
-            'SalaryCodeGroupIndicator': 'false',
-            'SalaryAgreementIndicator': 'false',
-            'StatusActiveIndicator': 'true',
-            'StatusPassiveIndicator': 'true',
-            'submit': 'OK',
-            'EffectiveDate': effective_date
-        }
-
         try:
-            response = self.get_request(path=path, params=params)
-
-            if not response:
-                logger.warning("No response from SD client")
-                return None
-
-            if not response['GetEmployment20111201']:
-                logger.warning("GetEmployment20111201 object not found")
-                return None
-
-            person_data = response['GetEmployment20111201'].get('Person', None)
-            if not person_data:
-                logger.warning(f"No employment data found for cpr: {cpr}")
-                return None
-
-            if isinstance(person_data, dict):
-                person_data = [person_data]
-
-            for person in person_data:
-                employment = person.get('Employment', None)
-                if not employment:
-                    logger.warning(f"Person has no employment object: {person} ")
-                    return None
-                return employment
+            response = self.get_request(path=EMPLOYMENT_PATH, params=employment_params(cpr, employment_identifier, inst_code, effective_date))
+            return parse_employment(response, cpr)
         except Exception as e:
             logger.error(f"An error occured GetEmployment20111201: {e}")
 
     def fetch_institutions_and_departments(self, region_identifier):
+        date_today = datetime.now().strftime('%d.%m.%Y')
+        return self.departments_cache.get_or_load(('region', region_identifier, date_today),
+                                                  lambda: self._fetch_institutions_and_departments(region_identifier, date_today))
+
+    def _fetch_institutions_and_departments(self, region_identifier, date_today):
         inst_and_dep = []
-        # Get institutions
-        path = 'GetInstitution20080201'
         try:
-            params = {
-                'RegionIdentifier': region_identifier
-            }
             logger.info("Fetching SD institutions...")
-            response = self.post_request(path=path, params=params)
-
-            if not response:
-                logger.warning("No response from SD client")
-                return None
-
-            if not response['GetInstitution20080201']:
-                logger.warning("GetInstitution20080201 object not found")
-                return None
-
-            if not response['GetInstitution20080201']['Region']:
-                logger.warning("Region object not found")
+            response = self.post_request(path=INSTITUTION_PATH, params={'RegionIdentifier': region_identifier})
+            inst_list = parse_institution_list(response)
+            if not inst_list:
                 return None
-            region = response['GetInstitution20080201']['Region']
-
-
-            if not region['Institution']:
-                logger.warning("Institution list not found")
-                return None
-            inst_list = region['Institution']
             logger.info("Fetching SD institutions success")
             # Get departments
-            path = 'GetDepartment20080201'
-            date_today = datetime.now().strftime('%d.%m.%Y')
             logger.info("Fetching SD departments...")
             for inst in inst_list:
                 institution_identifier = inst.get('InstitutionIdentifier', None)
@@ -214,28 +128,11 @@ class SDClient:
                 if not institution_identifier or not institution_name:
                     logger.warning("InstitutionIdentifier or InstitutionName is None")
                     continue
-                # Define the SD params
-                params = {
-                    'InstitutionIdentifier': institution_identifier,
-                    'ActivationDate': date_today,
-                    'DeactivationDate': date_today,
-                    'DepartmentNameIndicator': 'true'
-                }
-
-                response = self.post_request(path=path, params=params)
-
-                if not response:
-                    logger.warning("No response from SD client")
-                    return None
-
-                if not response['GetDepartment20080201']:
-                    logger.warning("GetDepartment20080201 object not found")
-                    return None
 
-                if not response['GetDepartment20080201']['Department']:
-                    logger.warning("Department list not found")
+                response = self.post_request(path=DEPARTMENT_PATH, params=department_params(institution_identifier, date_today))
+                department_list = parse_department_list(response)
+                if not department_list:
                     return None
-                department_list = response['GetDepartment20080201']['Department']
 
                 inst_and_dep_dict = {'InstitutionIdentifier': institution_identifier,
                                      'InstitutionName': institution_name,
@@ -250,49 +147,156 @@ class SDClient:
             return []
 
     def fetch_departments(self, inst_identifier):
-        inst_and_dep = []
+        if not inst_identifier:
+            logger.warning("InstitutionIdentifier is None")
+            return
+        date_today = datetime.now().strftime('%d.%m.%Y')
+        return self.departments_cache.get_or_load(('institution', inst_identifier, date_today),
+                                                  lambda: self._fetch_departments(inst_identifier, date_today))
+
+    def _fetch_departments(self, inst_identifier, date_today):
         try:
             # Get departments
-            path = 'GetDepartment20080201'
-            date_today = datetime.now().strftime('%d.%m.%Y')
             logger.info("Fetching SD departments...")
+            response = self.post_request(path=DEPARTMENT_PATH, params=department_params(inst_identifier, date_today))
+            department_list = parse_department_list(response)
+            if not department_list:
+                return None
+            logger.info("Fetching SD departments success")
+            return [{'InstitutionIdentifier': inst_identifier, 'Department': department_list}]
 
-            if not inst_identifier:
-                logger.warning("InstitutionIdentifier is None")
-                return
-            # Define the SD params
-            params = {
-                'InstitutionIdentifier': inst_identifier,
-                'ActivationDate': date_today,
-                'DeactivationDate': date_today,
-                'DepartmentNameIndicator': 'true'
-            }
+        except Exception as e:
+            logger.error(f"Error while fetching inst and departments: {e} \n"
+                         f"Institution identifier: {inst_identifier}")
+            return []
 
-            response = self.post_request(path=path, params=params)
 
-            if not response:
-                logger.warning("No response from SD client")
-                return None
+# SD request parameters and response parsing, shared with the async client in sd/async_sd_client.py
+EMPLOYMENT_PATH = 'GetEmployment20111201'
+INSTITUTION_PATH = 'GetInstitution20080201'
+DEPARTMENT_PATH = 'GetDepartment20080201'
 
-            if not response['GetDepartment20080201']:
-                logger.warning("GetDepartment20080201 object not found")
-                return None
 
-            if not response['GetDepartment20080201']['Department']:
-                logger.warning("Department list not found")
+def parse_sd_response(content, content_type):
+    # Returns the XML response as a dict - None for HTML, other content types and SOAP faults
+    if 'text/html' in content_type:
+        return None
+    elif 'application/xml' in content_type or 'text/xml' in content_type:
+        # Handle XML response
+        try:
+            response_dict = xml_to_json(content)
+            # Check for SOAP Fault in the response
+            fault = response_dict.get('Envelope', {}).get('Body', {}).get('Fault', None)
+            if fault:
+                fault_code = fault.get('faultcode', 'No fault code')
+                fault_string = fault.get('faultstring', 'No fault string')
+                fault_actor = fault.get('faultactor', 'No fault actor')
+                fault_detail = fault.get('detail', {}).get('string', 'No fault detail')
+                logger.error(
+                    f"SOAP Fault occurred: Code: {fault_code}, String: {fault_string}, Actor: {fault_actor}, Detail: {fault_detail}")
                 return None
-            department_list = response['GetDepartment20080201']['Department']
-
-            inst_and_dep_dict = {'InstitutionIdentifier': inst_identifier,
-                                 'Department': department_list}
-            inst_and_dep.append(inst_and_dep_dict)
-            logger.info("Fetching SD departments success")
-            return inst_and_dep
 
+            return response_dict
         except Exception as e:
-            logger.error(f"Error while fetching inst and departments: {e} \n"
-                         f"Institution identifier: {inst_identifier}")
-            return []
+            logger.error(f"An error occurred while parsing the XML response: {e}")
+            return None
+    else:
+        logger.warning("Received a response that is neither HTML nor XML.")
+        return None
+
+
+def employment_params(cpr, employment_identifier, inst_code, effective_date=None):
+    if not effective_date:
+        # Get the current date and format it as DD.MM.YYYY
+        effective_date = "01.01.5000"
+
+    # Define the SD params
+    return {
+        'InstitutionIdentifier': inst_code,
+        'EmploymentStatusIndicator': 'true',
+        # Strip "-" from cpr
+        'PersonCivilRegistrationIdentifier': cpr.replace("-", ""),
+        'EmploymentIdentifier': employment_identifier,
+        'DepartmentIdentifier': '',
+        'ProfessionIndicator': 'false',
+        'DepartmentIndicator': 'true',
+        'WorkingTimeIndicator': 'false',
+        'SalaryCodeGroupIndicator': 'false',
+        'SalaryAgreementIndicator': 'false',
+        'StatusActiveIndicator': 'true',
+        'StatusPassiveIndicator': 'true',
+        'submit': 'OK',
+        'EffectiveDate': effective_date
+    }
+
+
+def parse_employment(response, cpr):
+    if not response:
+        logger.warning("No response from SD client")
+        return None
+
+    if not response['GetEmployment20111201']:
+        logger.warning("GetEmployment20111201 object not found")
+        return None
+
+    person_data = response['GetEmployment20111201'].get('Person', None)
+    if not person_data:
+        logger.warning(f"No employment data found for cpr: {cpr.replace('-', '')}")
+        return None
+
+    if isinstance(person_data, dict):
+        person_data = [person_data]
+
+    for person in person_data:
+        employment = person.get('Employment', None)
+        if not employment:
+            logger.warning(f"Person has no employment object: {person} ")
+            return None
+        return employment
+
+
+def parse_institution_list(response):
+    if not response:
+        logger.warning("No response from SD client")
+        return None
+
+    if not response['GetInstitution20080201']:
+        logger.warning("GetInstitution20080201 object not found")
+        return None
+
+    if not response['GetInstitution20080201']['Region']:
+        logger.warning("Region object not found")
+        return None
+    region = response['GetInstitution20080201']['Region']
+
+    if not region['Institution']:
+        logger.warning("Institution list not found")
+        return None
+    return region['Institution']
+
+
+def department_params(inst_identifier, date_today):
+    return {
+        'InstitutionIdentifier': inst_identifier,
+        'ActivationDate': date_today,
+        'DeactivationDate': date_today,
+        'DepartmentNameIndicator': 'true'
+    }
+
+
+def parse_department_list(response):
+    if not response:
+        logger.warning("No response from SD client")
+        return None
+
+    if not response['GetDepartment20080201']:
+        logger.warning("GetDepartment20080201 object not found")
+        return None
+
+    if not response['GetDepartment20080201']['Department']:
+        logger.warning("Department list not found")
+        return None
+    return response['GetDepartment20080201']['Department']
 
 
 def xml_to_json(xml_data):
@@ -5,11 +5,14 @@ import sys
 import time
 import logging
 import re
+import threading
+import uuid
 
 from werkzeug import serving
 
-from config import SBSYS_URL, SBSIP_URL, SBSYS_CLIENT_ID, SBSYS_CLIENT_SECRET, SBSYS_USERNAME, SBSYS_PASSWORD, DEBUG
+from config import SBSYS_URL, SBSIP_URL, SBSYS_CLIENT_ID, SBSYS_CLIENT_SECRET, SBSYS_USERNAME, SBSYS_PASSWORD, SBSYS_TOKEN_REFRESH_MARGIN_SECONDS, DEBUG
 from database import SignaturFileupload, STATUS_CODE
+from http_session import create_session
 
 logger = logging.getLogger(__name__)
 
@@ -30,52 +33,198 @@ def disable_endpoint_logs(disabled_endpoints):
     serving.WSGIRequestHandler.log_request = log_request
 
 
-# Håndtering af http request
-class APIClient:
-    def __init__(self, sbsys_url, sbsip_url, client_id, client_secret, username, password):
-        self.sbsys_url = sbsys_url
-        self.sbsip_url = sbsip_url
+# Holds the SBSIP access token, refreshing it before it expires
+class TokenManager:
+    def __init__(self, session, sbsip_url, client_id, client_secret, username, password, refresh_margin=30):
+        self.session = session
+        self.token_url = f"{sbsip_url}/auth/realms/sbsip/protocol/openid-connect/token"
         self.client_id = client_id
         self.client_secret = client_secret
         self.username = username
         self.password = password
+        self.refresh_margin = refresh_margin
         self.access_token = None
         self.token_expiry = None
+        self.refresh_token = None
+        self.refresh_token_expiry = None
+        self.refresh_timer = None
+        # Set when the token is used - the background refresh stops when the token wasn't used since the last refresh
+        self.requested = False
+        self.lock = threading.Lock()
 
-    def authenticate(self):
-        sbsip_url = f"{self.sbsip_url}/auth/realms/sbsip/protocol/openid-connect/token"
-        json_data = {
-            "grant_type": "password",
-            "client_id": self.client_id,
-            "client_secret": self.client_secret,
-            "username": self.username,
-            "password": self.password
-        }
+    def is_valid(self):
+        return self.access_token and self.token_expiry and time.time() < self.token_expiry - self.refresh_margin
+
+    def get_access_token(self):
+        self.requested = True
+        if self.is_valid():
+            return self.access_token
+        with self.lock:
+            # Another thread may have refreshed the token while we waited
+            if self.is_valid():
+                return self.access_token
+            return self._refresh()
+
+    def invalidate(self):
+        with self.lock:
+            self.access_token = None
+            self.token_expiry = None
+
+    def _request_token(self, data):
         headers = {
             "Content-Type": "application/x-www-form-urlencoded"
         }
         try:
-            response = requests.post(sbsip_url, headers=headers, data=json_data)
+            response = self.session.post(self.token_url, headers=headers, data=data)
             response.raise_for_status()
-            data = response.json()
-            self.access_token = data['access_token']
-            self.token_expires = time.time() + data['expires_in']
-            return self.access_token
+            return response.json()
         except requests.exceptions.RequestException as e:
-            logging.error(e)
+            logger.error(f"Error requesting SBSIP token with grant_type {data['grant_type']}: {e}")
+            return None
+
+    def _refresh(self):
+        # Must be called with self.lock held
+        data = None
+        if self.refresh_token and (not self.refresh_token_expiry or time.time() < self.refresh_token_expiry - self.refresh_margin):
+            data = self._request_token({
+                "grant_type": "refresh_token",
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "refresh_token": self.refresh_token
+            })
+        if not data:
+            data = self._request_token({
+                "grant_type": "password",
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "username": self.username,
+                "password": self.password
+            })
+        if not data:
+            return None
+
+        now = time.time()
+        self.access_token = data['access_token']
+        self.token_expiry = now + data['expires_in']
+        self.refresh_token = data.get('refresh_token', None)
+        # Keycloak uses refresh_expires_in 0 for refresh tokens without expiry
+        self.refresh_token_expiry = now + data['refresh_expires_in'] if data.get('refresh_expires_in', None) else None
+        self._schedule_refresh(data['expires_in'])
+        return self.access_token
+
+    def _schedule_refresh(self, expires_in):
+        # Refresh in the background before requests would have to wait for a new token
+        if self.refresh_timer:
+            self.refresh_timer.cancel()
+        # At least half the lifetime, so short-lived tokens don't cause a refresh loop
+        delay = max(expires_in * 0.5, expires_in - 2 * self.refresh_margin, 1)
+        self.refresh_timer = threading.Timer(delay, self._background_refresh)
+        self.refresh_timer.daemon = True
+        self.refresh_timer.start()
+
+    def _background_refresh(self):
+        with self.lock:
+            if not self.requested:
+                # Idle - the next request gets a new token itself
+                logger.debug("SBSIP access token not used since the last refresh - stopping background refresh")
+                self.refresh_timer = None
+                return
+            self.requested = False
+            logger.debug("Refreshing SBSIP access token")
+            self._refresh()
+
+
+# multipart/form-data request body that reads the files as it is sent, so they are never held in memory as a whole.
+# fields is a dict of name -> str and files a dict of name -> (filename, stream, mimetype, size).
+class MultipartStream:
+    def __init__(self, fields, files, chunk_size=64 * 1024):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.chunk_size = chunk_size
+        # Each part is either bytes or a (stream, size) tuple
+        self.parts = []
+        for name, value in fields.items():
+            self.parts.append(self.part_header(name) + b'\r\n' + str(value).encode('utf-8') + b'\r\n')
+        for name, (filename, stream, mimetype, size) in files.items():
+            if size is None:
+                size = stream.seek(0, 2)
+            self.parts.append(self.part_header(name, filename) + f'Content-Type: {mimetype}\r\n\r\n'.encode('utf-8'))
+            self.parts.append((stream, size))
+            self.parts.append(b'\r\n')
+        self.parts.append(f'--{self.boundary}--\r\n'.encode('utf-8'))
+        self.length = sum(len(part) if isinstance(part, bytes) else part[1] for part in self.parts)
+        self.rewind()
+
+    def part_header(self, name, filename=None):
+        header = f'--{self.boundary}\r\nContent-Disposition: form-data; name="{self.quote(name)}"'
+        if filename is not None:
+            header += f'; filename="{self.quote(filename)}"'
+        return (header + '\r\n').encode('utf-8')
+
+    @staticmethod
+    def quote(value):
+        # Same escaping of header parameters as urllib3 uses for multipart fields
+        return value.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+
+    def rewind(self):
+        # Start over, e.g. before sending the body again
+        self.index = 0
+        self.offset = 0
+        for part in self.parts:
+            if not isinstance(part, bytes):
+                part[0].seek(0)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        chunk = self.read(self.chunk_size)
+        while chunk:
+            yield chunk
+            chunk = self.read(self.chunk_size)
+
+    def read(self, size=-1):
+        chunks = []
+        remaining = size if size is not None and size >= 0 else self.length
+        while remaining > 0 and self.index < len(self.parts):
+            part = self.parts[self.index]
+            if isinstance(part, bytes):
+                chunk = part[self.offset:self.offset + remaining]
+                part_size = len(part)
+            else:
+                stream, part_size = part
+                chunk = stream.read(min(remaining, part_size - self.offset))
+                if not chunk and part_size > self.offset:
+                    raise IOError(f"File ended after {self.offset} of {part_size} bytes")
+            chunks.append(chunk)
+            self.offset += len(chunk)
+            remaining -= len(chunk)
+            if self.offset >= part_size:
+                self.index += 1
+                self.offset = 0
+        return b''.join(chunks)
+
+
+# Håndtering af http request
+class APIClient:
+    def __init__(self, sbsys_url, sbsip_url, client_id, client_secret, username, password, token_refresh_margin=30):
+        self.sbsys_url = sbsys_url
+        self.session = create_session('sbsys')
+        self.token_manager = TokenManager(self.session, sbsip_url, client_id, client_secret, username, password, token_refresh_margin)
+
+    def authenticate(self):
+        self.token_manager.invalidate()
+        return self.token_manager.get_access_token()
 
     def get_access_token(self):
-        # Check if there is a valid access token and it hasn't expired yet
-        if self.access_token and self.token_expiry and time.time() < self.token_expiry:
-            return self.access_token
-        return self.authenticate()
+        return self.token_manager.get_access_token()
 
-    def _make_request(self, method, path, **kwargs):
+    def _make_request(self, method, path, retry_unauthorized=True, content_type="application/json", **kwargs):
         token = self.get_access_token()
         url = f"{self.sbsys_url}/{path}"
         headers = {
             "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
+            "Content-Type": content_type
         }
 
         # Check if files are present in kwargs
@@ -85,6 +234,12 @@ class APIClient:
 
         try:
             response = method(url, headers=headers, **kwargs)
+            if response.status_code == 401 and retry_unauthorized:
+                # The token was revoked or expired early - get a new one and try once more
+                self.token_manager.invalidate()
+                if isinstance(kwargs.get('data', None), MultipartStream):
+                    kwargs['data'].rewind()
+                return self._make_request(method, path, retry_unauthorized=False, content_type=content_type, **kwargs)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -92,26 +247,27 @@ class APIClient:
             return None
 
     def get(self, path):
-        return self._make_request(requests.get, path)
+        return self._make_request(self.session.get, path)
 
     def post_upload(self, path, data=None, files=None):
-        return self._make_request(requests.post, path, data=data, files=files)
+        body = MultipartStream(data or {}, files or {})
+        return self._make_request(self.session.post, path, content_type=body.content_type, data=body)
 
     def post(self, path, data=None):
-        return self._make_request(requests.post, path, json=data)
+        return self._make_request(self.session.post, path, json=data)
 
     def put(self, path, data=None):
-        return self._make_request(requests.put, path, data=data, json=data)
+        return self._make_request(self.session.put, path, data=data, json=data)
 
     def delete(self, path):
-        return self._make_request(requests.delete, path)
+        return self._make_request(self.session.delete, path)
     
 # Samling af sbsys requests
 class SBSYSClient:
     def __init__(self):
         print(SBSYS_CLIENT_ID)
         print(SBSYS_USERNAME)
-        self.api_client = APIClient(SBSYS_URL, SBSIP_URL, SBSYS_CLIENT_ID, SBSYS_CLIENT_SECRET, SBSYS_USERNAME, SBSYS_PASSWORD)
+        self.api_client = APIClient(SBSYS_URL, SBSIP_URL, SBSYS_CLIENT_ID, SBSYS_CLIENT_SECRET, SBSYS_USERNAME, SBSYS_PASSWORD, SBSYS_TOKEN_REFRESH_MARGIN_SECONDS)
 
     # søg efter sager
     def search_cases(self, body):
@@ -0,0 +1,11 @@
+import os
+import sys
+
+# config.py requires these - the tests don't talk to the real services
+for name in ['KEYCLOAK_URL', 'KEYCLOAK_REALM', 'KEYCLOAK_AUDIENCE', 'SBSYS_URL', 'SBSIP_URL', 'SBSYS_CLIENT_ID', 'SBSYS_CLIENT_SECRET',
+             'SBSYS_USERNAME', 'SBSYS_PASSWORD', 'DB_NAME', 'DB_USER', 'DB_PASSWORD', 'DB_HOST', 'BROWSERLESS_URL', 'BROWSERLESS_CLIENT_ID',
+             'BROWSERLESS_CLIENT_SECRET', 'SD_USERNAME', 'SD_PASSWORD', 'SD_URL', 'SD_PERSONALESAG_ROBOT_USERNAME', 'SD_PERSONALESAG_ROBOT_PASSWORD']:
+    os.environ.setdefault(name, 'http://localhost' if name.endswith('_URL') else 'test')
+os.environ.setdefault('DB_PORT', '5432')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
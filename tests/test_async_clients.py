@@ -0,0 +1,148 @@
+import asyncio
+import io
+import time
+
+import httpx
+
+from async_sbsys_client import AsyncSBSYSClient
+from sd.async_sd_client import AsyncSDClient
+from utils import TokenManager
+
+
+class FakeTokenResponse:
+    def __init__(self, token):
+        self.token = token
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'access_token': self.token, 'expires_in': 300}
+
+
+class FakeTokenSession:
+    def __init__(self):
+        self.requests = 0
+
+    def post(self, url, headers=None, data=None):
+        self.requests += 1
+        return FakeTokenResponse(f'token-{self.requests}')
+
+
+def token_manager():
+    manager = TokenManager(FakeTokenSession(), 'http://sbsip', 'client', 'secret', 'user', 'password')
+    manager.access_token = 'token-0'
+    manager.token_expiry = time.time() + 300
+    return manager
+
+
+def mock_client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_sd_cached_loads_a_key_once_for_concurrent_callers():
+    async def run():
+        client = AsyncSDClient('user', 'password', 'http://sd')
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return ['department']
+
+        results = await asyncio.gather(*(client.cached('key', loader) for _ in range(5)))
+        cached = await client.cached('key', loader)
+        await client.aclose()
+        return calls, results + [cached], client.loading, client.cache_stats()
+
+    calls, results, loading, stats = asyncio.run(run())
+    assert len(calls) == 1
+    assert results == [['department']] * 6
+    assert loading == {}
+    assert stats == {'hits': 1, 'misses': 1, 'coalesced': 4, 'size': 1}
+
+
+def test_sd_cached_does_not_cache_empty_results():
+    async def run():
+        client = AsyncSDClient('user', 'password', 'http://sd')
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            return None
+
+        await client.cached('key', loader)
+        await client.cached('key', loader)
+        await client.aclose()
+        return calls
+
+    assert len(asyncio.run(run())) == 2
+
+
+def test_sd_fetch_departments_parses_the_xml_response():
+    xml = (b'<GetDepartment20080201><Department><DepartmentIdentifier>ABC</DepartmentIdentifier></Department>'
+           b'<Department><DepartmentIdentifier>DEF</DepartmentIdentifier></Department></GetDepartment20080201>')
+
+    def handler(request):
+        assert request.url.params['InstitutionIdentifier'] == 'XY'
+        return httpx.Response(200, content=xml, headers={'Content-Type': 'application/xml'})
+
+    async def run():
+        client = AsyncSDClient('user', 'password', 'http://sd')
+        client.api_client.client = mock_client(handler)
+        departments = await client.fetch_departments('XY')
+        await client.aclose()
+        return departments
+
+    departments = asyncio.run(run())
+    assert departments[0]['InstitutionIdentifier'] == 'XY'
+    assert [d['DepartmentIdentifier'] for d in departments[0]['Department']] == ['ABC', 'DEF']
+
+
+def test_sbsys_client_uses_the_token_manager_it_is_given():
+    manager = token_manager()
+    client = AsyncSBSYSClient(manager)
+    assert client.api_client.token_manager is manager
+
+    def handler(request):
+        assert request.headers['Authorization'] == 'Bearer token-0'
+        return httpx.Response(200, json={'Id': 1})
+
+    async def run():
+        client.api_client.client = mock_client(handler)
+        response = await client.get_request('api/sag/1')
+        await client.aclose()
+        return response
+
+    assert asyncio.run(run()) == {'Id': 1}
+    assert manager.session.requests == 0
+
+
+def test_sbsys_upload_sends_content_length_and_the_whole_body_again_after_401():
+    manager = token_manager()
+    client = AsyncSBSYSClient(manager)
+    content = b'x' * 200_000
+    bodies = []
+
+    def handler(request):
+        body = request.read()
+        assert int(request.headers['Content-Length']) == len(body)
+        bodies.append((request.headers['Authorization'], body))
+        if len(bodies) == 1:
+            return httpx.Response(401)
+        return httpx.Response(200, json={'Id': 2})
+
+    async def run():
+        client.api_client.client = mock_client(handler)
+        response = await client.journalise_file_personalesag({'json': '{}'}, {'file': ('a.pdf', io.BytesIO(content), 'application/pdf', len(content))}, 7)
+        await client.aclose()
+        return response
+
+    try:
+        assert asyncio.run(run()) == {'Id': 2}
+    finally:
+        if manager.refresh_timer:
+            manager.refresh_timer.cancel()
+    assert [authorization for authorization, _ in bodies] == ['Bearer token-0', 'Bearer token-1']
+    assert bodies[0][1] == bodies[1][1]
+    assert content in bodies[1][1]
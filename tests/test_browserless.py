@@ -0,0 +1,44 @@
+import pytest
+
+import browserless
+from browserless import checkout_sd_session, read_browserless_response
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.content = b''
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture(autouse=True)
+def no_sessions(monkeypatch):
+    monkeypatch.setattr(browserless, 'sd_sessions', [])
+
+
+def test_a_session_is_used_by_one_run_at_a_time():
+    read_browserless_response(FakeResponse({'success': True, 'cookies': [{'name': 'JSESSIONID', 'value': '1'}]}))
+    assert checkout_sd_session() == [{'name': 'JSESSIONID', 'value': '1'}]
+    # A concurrent run logs in on its own
+    assert checkout_sd_session() == []
+
+
+def test_concurrent_runs_return_their_own_sessions():
+    for value in ['1', '2', '3']:
+        read_browserless_response(FakeResponse({'cookies': [{'name': 'JSESSIONID', 'value': value}]}))
+    assert len(browserless.sd_sessions) == browserless.BROWSERLESS_MAX_CONCURRENCY
+    first, second = checkout_sd_session(), checkout_sd_session()
+    assert first != second
+
+
+def test_a_failed_run_drops_its_session():
+    assert read_browserless_response(FakeResponse({'cookies': [{'name': 'JSESSIONID', 'value': '1'}]}, status_code=500)) is None
+    assert checkout_sd_session() == []
+
+
+def test_cookies_are_not_returned_with_the_data():
+    data = read_browserless_response(FakeResponse({'success': True, 'cookies': [{'name': 'JSESSIONID', 'value': '1'}]}))
+    assert data == {'success': True}
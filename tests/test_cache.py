@@ -0,0 +1,77 @@
+import threading
+import time
+
+from cache import TTLCache, LRUCache
+
+
+def test_get_or_load_runs_the_loader_once_for_concurrent_callers():
+    cache = TTLCache(60)
+    calls = []
+    started = threading.Event()
+
+    def loader():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('key', loader))) for _ in range(5)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ['value'] * 5
+    assert cache.stats() == {'hits': 4, 'misses': 1, 'coalesced': 4, 'size': 1}
+
+
+def test_get_or_load_does_not_cache_empty_results():
+    cache = TTLCache(60)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return None if len(calls) == 1 else ['value']
+
+    assert cache.get_or_load('key', loader) is None
+    assert cache.get_or_load('key', loader) == ['value']
+    assert cache.get_or_load('key', loader) == ['value']
+    assert len(calls) == 2
+
+
+def test_get_or_load_lets_the_next_caller_load_after_an_error():
+    cache = TTLCache(60)
+
+    def failing():
+        raise RuntimeError('SD is down')
+
+    try:
+        cache.get_or_load('key', failing)
+    except RuntimeError:
+        pass
+    assert cache.get_or_load('key', lambda: 'value') == 'value'
+    assert cache.loading == {}
+
+
+def test_entries_expire_after_ttl():
+    cache = TTLCache(0.05)
+    cache.set('key', 'value')
+    assert cache.get('key') == 'value'
+    time.sleep(0.06)
+    assert cache.get('key') is None
+    assert cache.get_or_load('key', lambda: 'new') == 'new'
+
+
+def test_lru_cache_evicts_the_least_recently_used():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
@@ -0,0 +1,78 @@
+import random
+
+from department_index import DepartmentNameIndex
+
+
+def find_department_codes(inst_list, sag_employment_location):
+    # The linear scan DepartmentNameIndex replaced, kept as the reference for its results
+    def recursive_search(department):
+        if isinstance(department, list):
+            codes = []
+            for dept in department:
+                result = recursive_search(dept)
+                if result:
+                    codes.extend(result)
+            return codes
+        elif isinstance(department, dict):
+            codes = []
+            department_name = department.get('DepartmentName', '')
+            if isinstance(department_name, str):
+                if sag_employment_location in department_name:
+                    codes.append(department.get('DepartmentIdentifier'))
+                if len(department_name) == 30 and sag_employment_location.startswith(department_name):
+                    codes.append(department.get('DepartmentIdentifier'))
+            if 'Department' in department and department['Department'] is not None:
+                codes.extend(recursive_search(department['Department']))
+            return codes
+        return []
+
+    codes = set()
+    for institution in inst_list:
+        codes.update(recursive_search(institution.get('Department', {})))
+    return codes
+
+
+def random_name(rng):
+    # A small alphabet, so names share ngrams and contain each other
+    return ''.join(rng.choice('abc d') for _ in range(rng.choice([1, 2, 5, 12, 30, 30, 40])))
+
+
+def random_departments(rng, depth, counter):
+    departments = []
+    for _ in range(rng.randint(1, 4)):
+        counter[0] += 1
+        department = {'DepartmentIdentifier': f'D{counter[0]}', 'DepartmentName': random_name(rng)}
+        if depth and rng.random() < 0.5:
+            department['Department'] = random_departments(rng, depth - 1, counter)
+        departments.append(department)
+    return departments[0] if len(departments) == 1 else departments
+
+
+def random_locations(rng, names):
+    for _ in range(50):
+        name = rng.choice(names)
+        start = rng.randrange(len(name))
+        yield name[start:start + rng.randint(0, 15)]
+        yield name + random_name(rng)
+        yield random_name(rng)
+    yield ''
+
+
+def test_find_matches_the_linear_scan():
+    rng = random.Random(4711)
+    for _ in range(30):
+        counter = [0]
+        inst_list = [{'InstitutionIdentifier': f'I{i}', 'Department': random_departments(rng, 3, counter)} for i in range(rng.randint(1, 3))]
+        index = DepartmentNameIndex(inst_list)
+        names = list(index.codes_by_name)
+        for location in random_locations(rng, names):
+            assert index.find(location) == find_department_codes(inst_list, location), location
+
+
+def test_find_truncated_names():
+    inst_list = [{'Department': [{'DepartmentIdentifier': 'A', 'DepartmentName': 'Sundheds- og Omsorgsforvaltnin'},
+                                 {'DepartmentIdentifier': 'B', 'DepartmentName': 'Omsorg'}]}]
+    index = DepartmentNameIndex(inst_list)
+    assert index.find('Sundheds- og Omsorgsforvaltningen') == {'A'}
+    assert index.find('Omsorg') == {'A', 'B'}
+    assert index.find('Skole') == set()
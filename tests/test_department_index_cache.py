@@ -0,0 +1,59 @@
+import logging
+from datetime import datetime
+
+import pytest
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from database import DatabaseClient, DepartmentIndexSnapshot
+from department_index import DepartmentIndexCache
+
+
+class SnapshotClient:
+    # The snapshot queries of DatabaseClient on a SQLite engine
+    get_department_index_snapshot = DatabaseClient.get_department_index_snapshot
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.logger = logging.getLogger(__name__)
+
+    def get_session(self):
+        return Session(self.engine)
+
+
+@pytest.fixture
+def engine():
+    engine = sqlalchemy.create_engine('sqlite://')
+    DepartmentIndexSnapshot.__table__.create(engine)
+    yield engine
+    engine.dispose()
+
+
+def save(engine, version, data):
+    with Session(engine) as session:
+        session.merge(DepartmentIndexSnapshot(region_identifier='9R', version=version, data=data, updated_at=datetime.now()))
+        session.commit()
+
+
+def test_data_is_only_loaded_for_a_new_version(engine):
+    statements = []
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+    cache = DepartmentIndexCache(SnapshotClient(engine), '9R', builder=None, refresh_interval=3600, check_interval=60)
+    loads_data = lambda: any('sd_department_index.data' in statement for statement in statements)
+
+    save(engine, 1, {'A': {'codes': ['1'], 'names': ['Skole']}})
+    statements.clear()
+    cache.load_snapshot()
+    assert loads_data()
+    assert cache.status()['version'] == 1
+
+    statements.clear()
+    cache.load_snapshot()
+    assert statements and not loads_data()
+
+    save(engine, 2, {'B': {'codes': ['2'], 'names': ['Børnehave']}})
+    statements.clear()
+    cache.load_snapshot()
+    assert loads_data()
+    assert cache.status()['version'] == 2
+    assert len(cache.get()) == 1
@@ -0,0 +1,40 @@
+import pytest
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from database import FileObject, SignaturFileupload
+
+
+@pytest.fixture
+def engine():
+    # has_file only needs the upload table - SQLite is enough to see which columns are loaded
+    engine = sqlalchemy.create_engine('sqlite://')
+    SignaturFileupload.__table__.create(engine)
+    yield engine
+    engine.dispose()
+
+
+def upload(file_data=None, file_oid=None):
+    upload = SignaturFileupload(FileObject(None, 'a.pdf', 'application/pdf'), 'XY', '12345', '0101011234')
+    upload.file_data = file_data
+    upload.file_oid = file_oid
+    return upload
+
+
+@pytest.mark.parametrize('file_data, file_oid, expected', [(b'legacy', None, True), (None, 4711, True), (None, None, False)])
+def test_has_file_does_not_load_file_data(engine, file_data, file_oid, expected):
+    with Session(engine) as session:
+        stored = upload(file_data, file_oid)
+        session.add(stored)
+        session.commit()
+        upload_id = stored.id
+
+    with Session(engine) as session:
+        stored = session.get(SignaturFileupload, upload_id)
+        assert stored.has_file() is expected
+        assert 'file_data' in sqlalchemy.inspect(stored).unloaded
+
+
+def test_has_file_of_a_new_upload():
+    assert upload(b'legacy').has_file()
+    assert not upload().has_file()
@@ -0,0 +1,32 @@
+import io
+
+import database
+from database import LargeObjectReader
+
+
+def reader(data):
+    # A BytesIO stands in for the psycopg2 lobject - both read, seek and tell the same way
+    large_object = LargeObjectReader(session=None, oid=1)
+    large_object.lobject = io.BytesIO(data)
+    return large_object
+
+
+def test_read_without_size_reads_to_the_end(monkeypatch):
+    monkeypatch.setattr(database, 'LARGE_OBJECT_CHUNK_SIZE', 4)
+    data = bytes(range(11))
+    assert reader(data).read() == data
+    assert reader(data).read(-1) == data
+    assert reader(data).readall() == data
+
+
+def test_read_continues_after_a_partial_read(monkeypatch):
+    monkeypatch.setattr(database, 'LARGE_OBJECT_CHUNK_SIZE', 4)
+    large_object = reader(b'abcdefghij')
+    assert large_object.read(3) == b'abc'
+    assert large_object.read() == b'defghij'
+    assert large_object.read() == b''
+
+
+def test_buffered_reader_returns_the_whole_file():
+    data = b'x' * 100_000
+    assert io.BufferedReader(reader(data)).read() == data
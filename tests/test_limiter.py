@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+from limiter import PriorityLimiter, LimiterTimeout
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_waiting_callers_go_by_priority_then_arrival():
+    limiter = PriorityLimiter(1, 5)
+    order = []
+
+    def call(name, priority):
+        with limiter.slot(priority):
+            order.append(name)
+
+    threads = []
+    with limiter.slot():
+        for i, (name, priority) in enumerate([('files-1', 10), ('exist-1', 0), ('files-2', 10), ('exist-2', 0), ('other', 5)]):
+            thread = threading.Thread(target=call, args=(name, priority))
+            thread.start()
+            threads.append(thread)
+            wait_until(lambda: limiter.metrics()['queued'] == i + 1)
+    for thread in threads:
+        thread.join()
+
+    assert order == ['exist-1', 'exist-2', 'other', 'files-1', 'files-2']
+
+
+def test_callers_run_up_to_max_concurrency():
+    limiter = PriorityLimiter(2, 5)
+    release = threading.Event()
+
+    def call():
+        with limiter.slot():
+            release.wait()
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: limiter.metrics()['active'] == 2 and limiter.metrics()['queued'] == 1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert limiter.metrics()['calls'] == 3
+
+
+def test_waiting_gives_up_after_queue_timeout():
+    limiter = PriorityLimiter(1, 0.05)
+    with limiter.slot():
+        with pytest.raises(LimiterTimeout):
+            with limiter.slot():
+                pass
+    metrics = limiter.metrics()
+    assert metrics['timeouts'] == 1
+    assert metrics['queued'] == 0
+    assert metrics['calls'] == 1
+
@@ -0,0 +1,78 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from lookups import run_lookups
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=2)
+    yield executor
+    executor.shutdown(wait=True, cancel_futures=True)
+
+
+def test_returns_the_results_by_name(executor):
+    results = run_lookups(executor, {'a': lambda: 1, 'b': lambda: [], 'c': lambda: None}, required=['a'], timeout=5)
+    assert results == {'a': 1, 'b': [], 'c': None}
+
+
+def test_failed_lookups_are_left_out(executor):
+    def failing():
+        raise RuntimeError('SBSYS is down')
+
+    results = run_lookups(executor, {'employment': lambda: 1, 'sager': failing}, required=['employment'], timeout=5)
+    assert results == {'employment': 1}
+
+
+def test_returns_early_when_a_required_lookup_fails(executor):
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return 'slow'
+
+    start = time.monotonic()
+    results = run_lookups(executor, {'employment': lambda: None, 'sager': slow}, required=['employment'], timeout=5)
+    release.set()
+    assert time.monotonic() - start < 1
+    assert results == {'employment': None}
+
+
+def test_lookups_share_one_deadline(executor):
+    release = threading.Event()
+
+    def slow(value, delay):
+        def lookup():
+            release.wait(delay)
+            return value
+        return lookup
+
+    start = time.monotonic()
+    results = run_lookups(executor, {'fast': slow('fast', 0.05), 'slow': slow('slow', 5)}, required=[], timeout=0.3)
+    elapsed = time.monotonic() - start
+    release.set()
+    assert results == {'fast': 'fast'}
+    assert 0.3 <= elapsed < 1
+
+
+def test_lookups_not_started_are_cancelled():
+    executor = ThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+    started = []
+
+    def blocking(name):
+        def lookup():
+            started.append(name)
+            release.wait(5)
+            return name
+        return lookup
+
+    # The only thread is busy with the first lookup, so the second is still queued when the deadline passes
+    results = run_lookups(executor, {'busy': blocking('busy'), 'queued': blocking('queued')}, required=[], timeout=0.1)
+    release.set()
+    executor.shutdown(wait=True)
+    assert results == {}
+    assert started == ['busy']
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+from database import FileObject, SignaturFileupload, STATUS_CODE
+
+
+def failed_upload():
+    upload = SignaturFileupload(FileObject(None, 'a.pdf', 'application/pdf'), 'XY', '12345', '0101011234')
+    upload.set_status(STATUS_CODE.FAILED_TRY_AGAIN, "Failed to upload file, try again")
+    return upload
+
+
+def test_delay_doubles_with_jitter_up_to_max_delay():
+    upload = failed_upload()
+    for attempt, delay in enumerate([60, 120, 240, 480, 600, 600], start=1):
+        before = datetime.now()
+        next_attempt_at = upload.schedule_retry(base_delay=60, max_delay=600, max_attempts=10)
+        after = datetime.now()
+        assert upload.attempt_count == attempt
+        assert upload.status == STATUS_CODE.FAILED_TRY_AGAIN
+        assert upload.next_attempt_at == next_attempt_at
+        assert before + timedelta(seconds=delay / 2) <= next_attempt_at <= after + timedelta(seconds=delay)
+
+
+def test_gives_up_at_max_attempts():
+    upload = failed_upload()
+    assert upload.schedule_retry(base_delay=60, max_delay=600, max_attempts=3)
+    assert upload.schedule_retry(base_delay=60, max_delay=600, max_attempts=3)
+    assert upload.schedule_retry(base_delay=60, max_delay=600, max_attempts=3) is None
+    assert upload.attempt_count == 3
+    assert upload.next_attempt_at is None
+    assert upload.status == STATUS_CODE.FAILED
+    assert upload.message == "Failed to upload file, try again - gave up after 3 attempts"
+
+
+def test_reset_attempts_starts_over():
+    upload = failed_upload()
+    upload.schedule_retry(base_delay=60, max_delay=600, max_attempts=3)
+    upload.schedule_retry(base_delay=60, max_delay=600, max_attempts=3)
+    upload.reset_attempts()
+    assert upload.attempt_count == 0
+    assert upload.next_attempt_at is None
+    assert upload.schedule_retry(base_delay=60, max_delay=600, max_attempts=3)
+    assert upload.attempt_count == 1
@@ -0,0 +1,45 @@
+import pytest
+
+from sbsys_operations import SBSYSOperations, SBSYSError
+
+
+class FakeSBSYSClient:
+    def __init__(self, response):
+        self.response = response
+        self.searches = 0
+
+    def search_cases(self, payload):
+        self.searches += 1
+        return self.response
+
+
+def operations(response):
+    sbsys = SBSYSOperations()
+    sbsys.client = FakeSBSYSClient(response)
+    return sbsys
+
+
+def sag(sag_id, status='Aktiv', nummer='81.03.00-G01-1-20'):
+    return {'Id': sag_id, 'SagsStatus': {'Navn': status}, 'Nummer': nummer}
+
+
+def test_returns_the_active_personalesager():
+    sbsys = operations({'Results': [sag(1), sag(2, status='Afsluttet'), sag(3, nummer='00.01.00-A00-1-20')]})
+    assert sbsys.fetch_active_personalesager('010101-1234') == [sag(1)]
+    assert sbsys.fetch_active_personalesager('0101011234') == [sag(1)]
+    assert sbsys.client.searches == 1
+
+
+@pytest.mark.parametrize('response', [{'Results': []}, {'Results': [sag(2, status='Afsluttet')]}, {'Results': [sag(3, nummer='00.01.00-A00-1-20')]}])
+def test_no_active_personalesager_is_empty_and_not_cached(response):
+    sbsys = operations(response)
+    assert sbsys.fetch_active_personalesager('0101011234') == []
+    assert sbsys.fetch_active_personalesager('0101011234') == []
+    assert sbsys.client.searches == 2
+
+
+def test_a_failed_search_raises():
+    # APIClient returns None on HTTP errors and timeouts
+    sbsys = operations(None)
+    with pytest.raises(SBSYSError):
+        sbsys.fetch_active_personalesager('0101011234')
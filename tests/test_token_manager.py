@@ -0,0 +1,109 @@
+import time
+
+import pytest
+import requests
+
+from utils import TokenManager
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        if self.data is None:
+            raise requests.exceptions.HTTPError('400 Client Error')
+
+    def json(self):
+        return self.data
+
+
+class FakeTokenSession:
+    def __init__(self, failing_grants=()):
+        self.grants = []
+        self.failing_grants = failing_grants
+
+    def post(self, url, headers=None, data=None):
+        self.grants.append(data['grant_type'])
+        if data['grant_type'] in self.failing_grants:
+            return FakeResponse(None)
+        return FakeResponse({'access_token': f'token-{len(self.grants)}', 'expires_in': 300,
+                             'refresh_token': f'refresh-{len(self.grants)}', 'refresh_expires_in': 1800})
+
+
+@pytest.fixture
+def managers():
+    created = []
+
+    def create(session, refresh_margin=30):
+        manager = TokenManager(session, 'http://sbsip', 'client', 'secret', 'user', 'password', refresh_margin)
+        created.append(manager)
+        return manager
+
+    yield create
+    for manager in created:
+        if manager.refresh_timer:
+            manager.refresh_timer.cancel()
+
+
+def test_token_is_reused_until_expires_in_minus_margin(managers):
+    session = FakeTokenSession()
+    manager = managers(session)
+    assert manager.get_access_token() == 'token-1'
+    assert manager.get_access_token() == 'token-1'
+    assert session.grants == ['password']
+
+    # Within the margin of expiring
+    manager.token_expiry = time.time() + 20
+    assert manager.get_access_token() == 'token-2'
+    assert session.grants == ['password', 'refresh_token']
+
+
+def test_refresh_token_grant_falls_back_to_password(managers):
+    session = FakeTokenSession(failing_grants=('refresh_token',))
+    manager = managers(session)
+    manager.get_access_token()
+    manager.invalidate()
+    assert manager.get_access_token() == 'token-3'
+    assert session.grants == ['password', 'refresh_token', 'password']
+
+
+def test_expired_refresh_token_is_not_used(managers):
+    session = FakeTokenSession()
+    manager = managers(session)
+    manager.get_access_token()
+    manager.invalidate()
+    manager.refresh_token_expiry = time.time() + 10
+    manager.get_access_token()
+    assert session.grants == ['password', 'password']
+
+
+def test_refresh_is_scheduled_at_half_the_lifetime_or_more(managers):
+    manager = managers(FakeTokenSession())
+    manager._schedule_refresh(300)
+    assert manager.refresh_timer.interval == 240
+    # Tokens living less than twice the margin
+    manager._schedule_refresh(50)
+    assert manager.refresh_timer.interval == 25
+
+
+def test_background_refresh_stops_when_the_token_is_not_requested(managers):
+    session = FakeTokenSession()
+    manager = managers(session)
+    manager.get_access_token()
+
+    # Requested since the token was fetched - refreshed and scheduled again
+    manager._background_refresh()
+    assert session.grants == ['password', 'refresh_token']
+    assert manager.refresh_timer is not None
+
+    # Not requested since the last refresh - stops
+    manager.refresh_timer.cancel()
+    manager._background_refresh()
+    assert session.grants == ['password', 'refresh_token']
+    assert manager.refresh_timer is None
+
+    # The next request gets a new token itself and schedules the refresh again
+    manager.invalidate()
+    assert manager.get_access_token() == 'token-3'
+    assert manager.refresh_timer is not None